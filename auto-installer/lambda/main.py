@@ -7,15 +7,28 @@ SageMaker Studio domain ID is either:
 - Configured via ENV_DOMAIN_ID environment variable, or else
 - Queried by the Lambda using SageMaker ListDomains API
 
-Commands to be executed are hard-coded in the COMMAND_SCRIPT variable below.
+If a release artifact of the extension (sagemaker_studio_autoshutdown-<version>.tar.gz or a wheel) is bundled with
+the function, or configured via the ARTIFACT_PATH environment variable, it is uploaded to the user's home folder
+(~/.auto-shutdown-artifacts, where it stays cached) and installed from there. Profiles where the extension already
+reports the artifact's version are skipped. Otherwise, the commands hard-coded in the COMMAND_SCRIPT variable below
+are run.
+
+Batch mode: if the input event includes a list of user profile names (UserProfileNames or userProfileNames), or
+AllUserProfiles (or allUserProfiles) set to true to select every user profile of the domain, the commands are run on
+up to MaxWorkers (or maxWorkers) profiles concurrently and the function returns the result and timing of each profile.
 """
 
 # Python Built-Ins:
+import base64
+import glob
+import hashlib
 import json
 import logging
 import os
 import re
 import time
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # External Dependencies:
 import boto3
@@ -33,9 +46,29 @@ COMMAND_SCRIPT = [
     "pwd && ls",
     "cd ~/.auto-shutdown && ./install_tarball.sh",
 ]
+# Release artifact of the extension to install instead of cloning the repository, and its expected SHA-256 if set:
+ENV_ARTIFACT_PATH = os.environ.get("ARTIFACT_PATH")
+ENV_ARTIFACT_SHA256 = os.environ.get("ARTIFACT_SHA256")
+ARTIFACT_DIR = "~/.auto-shutdown-artifacts"
+ARTIFACT_REGEX = r"^sagemaker_studio_autoshutdown-(\d+(?:\.\d+)*)(?:\.tar\.gz|-.*\.whl)$"
+# Each step is checked for success before the next one, and before the JupyterServer is restarted:
+ARTIFACT_INSTALL_SCRIPT = [
+    "pip install {artifact_dir}/{name}",
+    "jlpm config set cache-folder /tmp/yarncache",
+    "jupyter lab build --debug --minimize=False",
+]
+STEP_STATUS_SUFFIX = " && echo AUTO_SHUTDOWN_INSTALLED || echo AUTO_SHUTDOWN_FAILED"
+# The restart ends the terminal session, so no prompt is awaited after it:
+RESTART_COMMAND = "nohup supervisorctl -c /etc/supervisor/conf.d/supervisord.conf restart jupyterlabserver"
 # Regular expression for determining when the terminal has finished executing the last command and is ready
 # for next input:
 PROMPT_REGEX = r"bash-[\d\.]+\$ $"
+HTTP_TIMEOUT = 30  # Seconds, for each request to SageMaker Studio
+READY_TIMEOUT = 600  # Seconds to wait for the JupyterServer app to start up
+READY_BACKOFF = (1, 16)  # Initial and maximum delay between two readiness checks, in seconds
+COMMAND_TIMEOUT = 300  # Seconds without any terminal output before a command is considered stuck
+DEFAULT_MAX_WORKERS = 8  # Profiles processed concurrently in batch mode
+TIME_LIMIT_MARGIN = 30  # Seconds left to the Lambda function to report on a batch
 
 def get_domain_id() -> str:
     if ENV_DOMAIN_ID:
@@ -54,12 +87,73 @@ def get_domain_id() -> str:
     return domains[0]["DomainId"]
 
 
+@lru_cache(maxsize=1)
+def load_artifact():
+    """Load the release artifact once per Lambda container, or return None to install from the repository
+
+    Returns a dict with the artifact name, version, SHA-256 and base64 content.
+    """
+    path = ENV_ARTIFACT_PATH
+    if not path:
+        candidates = [
+            p for p in glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*"))
+            if re.match(ARTIFACT_REGEX, os.path.basename(p))
+        ]
+        if not candidates:
+            return None
+        # Pick the latest version if several artifacts were bundled
+        path = max(
+            candidates,
+            key=lambda p: [int(n) for n in re.match(ARTIFACT_REGEX, os.path.basename(p)).group(1).split(".")],
+        )
+
+    name = os.path.basename(path)
+    match = re.match(ARTIFACT_REGEX, name)
+    if match is None:
+        raise ValueError(f"Cannot tell the version of artifact {name}")
+    with open(path, "rb") as f:
+        content = f.read()
+    sha256 = hashlib.sha256(content).hexdigest()
+    if ENV_ARTIFACT_SHA256 and ENV_ARTIFACT_SHA256.lower() != sha256:
+        raise ValueError(f"Artifact {name} has SHA-256 {sha256}, expected {ENV_ARTIFACT_SHA256}")
+    logger.info(f"Loaded artifact {name} (SHA-256 {sha256})")
+    return {
+        "name": name,
+        "version": match.group(1),
+        "sha256": sha256,
+        "content": base64.b64encode(content).decode("ascii"),
+    }
+
+
+def list_user_profiles(domain_id: str) -> list:
+    """List the names of all the user profiles of a domain"""
+    user_profile_names = []
+    kwargs = {"DomainIdEquals": domain_id}
+    while True:
+        profiles_resp = smclient.list_user_profiles(**kwargs)
+        user_profile_names.extend(p["UserProfileName"] for p in profiles_resp["UserProfiles"])
+        if not profiles_resp.get("NextToken"):
+            return user_profile_names
+        kwargs["NextToken"] = profiles_resp["NextToken"]
+
+
 def lambda_handler(event, context):
     logger.debug("Received: %s", event)
     domain_id = event.get("DomainId", event.get("domainId"))
     if domain_id is None:
         domain_id = get_domain_id()
 
+    user_profile_names = event.get("UserProfileNames", event.get("userProfileNames"))
+    if event.get("AllUserProfiles", event.get("allUserProfiles")):
+        user_profile_names = list_user_profiles(domain_id)
+    if user_profile_names is not None:
+        max_workers = int(event.get("MaxWorkers", event.get("maxWorkers", DEFAULT_MAX_WORKERS)))
+        deadline = None
+        if context is not None:
+            deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - TIME_LIMIT_MARGIN
+        logger.info(f"Processing batch request for {len(user_profile_names)} profiles of {domain_id}")
+        return run_batch(domain_id, user_profile_names, max_workers, deadline)
+
     user_profile_name = event.get("UserProfileName", event.get("userProfileName"))
     if user_profile_name is None:
         raise ValueError(
@@ -67,11 +161,114 @@ def lambda_handler(event, context):
         )
 
     logger.info(f"Processing request for {domain_id}/{user_profile_name}")
-    run_commands(domain_id, user_profile_name)
+    result = run_profile(domain_id, user_profile_name)
+    if result["Status"] == "Failed":
+        raise RuntimeError(f"[{domain_id}/{user_profile_name}] {result['Error']}")
+    return result
+
+
+def run_batch(domain_id: str, user_profile_names: list, max_workers: int = DEFAULT_MAX_WORKERS, deadline=None) -> dict:
+    """Run the commands on many user profiles, with at most max_workers profiles in flight
+
+    Profiles not completed by the deadline (a time.monotonic() value) are reported as timed out.
+    """
+    start = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    futures = [executor.submit(run_profile, domain_id, name) for name in user_profile_names]
+    wait(futures, timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+    for future in futures:
+        future.cancel()
+    executor.shutdown(wait=False)
+
+    results = []
+    for user_profile_name, future in zip(user_profile_names, futures):
+        if future.done() and not future.cancelled():
+            results.append(future.result())
+        else:
+            results.append({
+                "DomainId": domain_id,
+                "UserProfileName": user_profile_name,
+                "Status": "TimedOut",
+                "Error": "Not completed before the Lambda time limit",
+            })
+    statuses = [result["Status"] for result in results]
+    return {
+        "DomainId": domain_id,
+        "Succeeded": statuses.count("Succeeded"),
+        "Skipped": statuses.count("Skipped"),
+        "Failed": statuses.count("Failed"),
+        "TimedOut": statuses.count("TimedOut"),
+        "Seconds": round(time.monotonic() - start, 3),
+        "Results": results,
+    }
+
+
+def run_profile(domain_id: str, user_profile_name: str) -> dict:
+    """Run the commands on one user profile, returning its status and the duration of each phase"""
+    result = {
+        "DomainId": domain_id,
+        "UserProfileName": user_profile_name,
+        "Status": "Failed",
+        "Phases": {},
+    }
+    start = time.monotonic()
+    try:
+        result["Status"] = run_commands(domain_id, user_profile_name, result["Phases"])
+    except Exception as e:
+        logger.exception(f"[{domain_id}/{user_profile_name}] Failed")
+        result["Error"] = f"{type(e).__name__}: {e}"
+    result["Seconds"] = round(time.monotonic() - start, 3)
+    return result
 
 
-def run_commands(domain_id: str, user_profile_name: str):
-    logger.info(f"[{domain_id}/{user_profile_name}] Generating presigned URL")
+def wait_for_prompt(ws, log_prefix: str):
+    """Read terminal messages as they arrive until the shell prompt is shown
+
+    recv() blocks until the next message, or raises websocket.WebSocketTimeoutException after COMMAND_TIMEOUT
+    seconds without output. Returns the tail of the output, for commands whose result needs checking.
+    """
+    prompt_exp = re.compile(PROMPT_REGEX, re.MULTILINE)
+    output = ""
+    while True:
+        res = json.loads(ws.recv())
+        # res[0] is the stream so will be e.g. 'stdout', 'stderr'
+        # res[1] is the content
+        logger.info(f"{log_prefix} {res[0]}: {res[1]}")
+        # You may want to apply some more RegExs here to log a little less verbosely, or actively
+        # check for failure/success of your particular script.
+        if res[0] == "stdout":
+            # The prompt may be split across messages
+            output = (output + res[1])[-1024:]
+            if prompt_exp.search(output):
+                return output
+
+
+def run_command(ws, command: str, log_prefix: str) -> str:
+    """Send a command to the terminal and return its output once the prompt is shown again"""
+    ws.send(json.dumps(["stdin", command + "\n"]))
+    # Assuming echo is on, stdin messages will be echoed to stdout anyway so no need to log
+    return wait_for_prompt(ws, log_prefix)
+
+
+def terminal_marker(output: str):
+    """Find a AUTO_SHUTDOWN_* marker printed on a line of its own (not in the echoed command line)"""
+    match = re.search(r"^AUTO_SHUTDOWN_([A-Z]+)\r?$", output, re.MULTILINE)
+    return match and match.group(1)
+
+
+def run_commands(domain_id: str, user_profile_name: str, phases: dict = None) -> str:
+    """Install the extension for a user profile, returning "Succeeded" or "Skipped" (if already up to date)"""
+    log_prefix = f"[{domain_id}/{user_profile_name}]"
+    phases = {} if phases is None else phases
+    phase_start = time.monotonic()
+
+    def end_phase(name):
+        nonlocal phase_start
+        now = time.monotonic()
+        phases[name] = round(now - phase_start, 3)
+        phase_start = now
+
+    logger.info(f"{log_prefix} Generating presigned URL")
     # (This will only work for IAM-authenticated Studio domains)
     presigned_resp = smclient.create_presigned_domain_url(
         DomainId=domain_id,
@@ -81,33 +278,57 @@ def run_commands(domain_id: str, user_profile_name: str):
 
     # Login URL like https://d-....studio.{AWSRegion}.sagemaker.aws/auth?token=...
     # API relative to https://d-....studio.{AWSRegion}.sagemaker.aws/jupyter/default
-    api_base_url = sagemaker_login_url.partition("?")[0].rpartition("/")[0] + "/jupyter/default"
+    base_url = sagemaker_login_url.partition("?")[0].rpartition("/")[0]
+    api_base_url = base_url + "/jupyter/default"
 
     # Need to make our requests via a session so cookies/etc persist:
     reqsess = requests.Session()
-    logger.info(f"[{domain_id}/{user_profile_name}] Logging in")
-    login_resp = reqsess.get(sagemaker_login_url)
+    logger.info(f"{log_prefix} Logging in")
+    login_resp = reqsess.get(sagemaker_login_url, timeout=HTTP_TIMEOUT)
+    end_phase("Login")
 
     # If JupyterServer app only just started up, it may not be ready yet: In which case we need to wait for
-    # it to start. Here we'll use the same 2sec /app polling logic as implemented by the SMStudio front-end
-    # at the time of writing:
+    # it to start. The app status is polled with an exponential backoff, so that apps starting quickly are
+    # picked up quickly without polling slow ones every 2 seconds:
     if "_xsrf" not in reqsess.cookies:
-        logger.info(f"[{domain_id}/{user_profile_name}] Waiting for JupyterServer start-up...")
+        logger.info(f"{log_prefix} Waiting for JupyterServer start-up...")
         app_status = "Unknown"
-        base_url = sagemaker_login_url.partition("?")[0].rpartition("/")[0]
+        delay, max_delay = READY_BACKOFF
+        ready_deadline = time.monotonic() + READY_TIMEOUT
         while app_status not in {"InService", "Terminated"}:
-            time.sleep(2)
-            app_status = reqsess.get(f"{base_url}/app?appType=JupyterServer&appName=default").text
+            if time.monotonic() + delay > ready_deadline:
+                raise TimeoutError(f"JupyterServer app not ready after {READY_TIMEOUT}s (status '{app_status}')")
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+            app_status = reqsess.get(
+                f"{base_url}/app?appType=JupyterServer&appName=default", timeout=HTTP_TIMEOUT
+            ).text
             logger.debug(f"Got app_status {app_status}")
 
         if app_status == "InService":
-            logger.info(f"[{domain_id}/{user_profile_name}] JupyterServer app ready")
-            ready_resp = reqsess.get(api_base_url)
+            logger.info(f"{log_prefix} JupyterServer app ready")
+            ready_resp = reqsess.get(api_base_url, timeout=HTTP_TIMEOUT)
         else:
             raise ValueError(f"JupyterServer app in unusable status '{app_status}'")
+        end_phase("Ready")
 
+    artifact = load_artifact()
+    if artifact is not None:
+        # Skip the (slow) install and JupyterServer restart if the extension is already at this version:
+        probe_resp = reqsess.get(f"{api_base_url}/sagemaker-studio-autoshutdown/idle_checker", timeout=HTTP_TIMEOUT)
+        installed_version = None
+        if probe_resp.status_code == 200:
+            try:
+                installed_version = probe_resp.json().get("version")
+            except ValueError:
+                pass
+        end_phase("Probe")
+        if installed_version == artifact["version"]:
+            logger.info(f"{log_prefix} Extension {installed_version} already installed, skipping")
+            return "Skipped"
+        logger.info(f"{log_prefix} Installed extension version {installed_version}, installing {artifact['version']}")
 
-    logger.info(f"[{domain_id}/{user_profile_name}] Creating terminal")
+    logger.info(f"{log_prefix} Creating terminal")
     terminal_resp = reqsess.post(
         f"{api_base_url}/api/terminals",
         # The XSRF token is required on any state-changing request types e.g. POST/DELETE/etc, but seems
@@ -115,46 +336,86 @@ def run_commands(domain_id: str, user_profile_name: str):
         # For more information on this pattern, you can see e.g:
         # https://cheatsheetseries.owasp.org/cheatsheets/Cross-Site_Request_Forgery_Prevention_Cheat_Sheet.html
         params={ "_xsrf": reqsess.cookies["_xsrf"] },
+        timeout=HTTP_TIMEOUT,
     )
+    terminal_resp.raise_for_status()
     terminal = terminal_resp.json()
     terminal_name = terminal["name"]  # Typically e.g. '1'.
 
     # Actually using a terminal (or notebook kernel) is done via websocket channels
-    ws_base_url = "wss://" + api_base_url.partition("://")[2] + "/terminals/websocket"
+    # (wss:// for https:// Studio URLs, ws:// for plain http:// test servers)
+    ws_base_url = re.sub(r"^http", "ws", api_base_url) + "/terminals/websocket"
     cookies = reqsess.cookies.get_dict()
 
-    logger.info(f"[{domain_id}/{user_profile_name}] Connecting to:\n{ws_base_url}/{terminal_name}")
+    logger.info(f"{log_prefix} Connecting to:\n{ws_base_url}/{terminal_name}")
     ws = websocket.create_connection(
         f"{ws_base_url}/{terminal_name}",
         cookie="; ".join(["%s=%s" %(i, j) for i, j in cookies.items()]),
+        timeout=COMMAND_TIMEOUT,
     )
+    end_phase("Terminal")
 
     try:
-        logger.info(f"[{domain_id}/{user_profile_name}] Waiting for setup message")
+        logger.info(f"{log_prefix} Waiting for setup message")
         setup = None
-        while setup is not None:
+        while setup is None:
             res = json.loads(ws.recv())
             if res[0] == "setup":
                 setup = res[1]  # Just get {} in all my tests
 
-        # Send commands one by one, waiting for each to complete and re-show prompt:
-        prompt_exp = re.compile(PROMPT_REGEX, re.MULTILINE)
-        for ix, c in enumerate(COMMAND_SCRIPT):
-            ws.send(json.dumps(["stdin", c + "\n"]))
-            # Assuming echo is on, stdin messages will be echoed to stdout anyway so no need to log
-
-            while True:
-                res = json.loads(ws.recv())
-                # res[0] is the stream so will be e.g. 'stdout', 'stderr'
-                # res[1] is the content
-                logger.info(f"[{domain_id}/{user_profile_name}] {res[0]}: {res[1]}")
-                # You may want to apply some more RegExs here to log a little less verbosely, or actively
-                # check for failure/success of your particular script.
-                if res[0] == "stdout" and prompt_exp.search(res[1]):
-                    break
-                # No need to push too hard in recv()ing the tiniest possible chunks!
-                time.sleep(0.1)
-
-        logger.info(f"[{domain_id}/{user_profile_name}] Complete")
+        # Wait for the first prompt, so that it is not mistaken for the end of the first command
+        wait_for_prompt(ws, log_prefix)
+
+        if artifact is None:
+            # Send commands one by one, waiting for each to complete and re-show prompt:
+            for c in COMMAND_SCRIPT:
+                run_command(ws, c, log_prefix)
+        else:
+            install_artifact(ws, reqsess, api_base_url, artifact, log_prefix, end_phase)
+            for c in ARTIFACT_INSTALL_SCRIPT:
+                c = c.format(artifact_dir=ARTIFACT_DIR, name=artifact["name"])
+                output = run_command(ws, c + STEP_STATUS_SUFFIX, log_prefix)
+                if terminal_marker(output) != "INSTALLED":
+                    raise RuntimeError(f"Install step failed, not restarting JupyterServer: {c}")
+            ws.send(json.dumps(["stdin", RESTART_COMMAND + "\n"]))
+
+        end_phase("Commands")
+        logger.info(f"{log_prefix} Complete")
     finally:
         ws.close()
+    return "Succeeded"
+
+
+def install_artifact(ws, reqsess, api_base_url: str, artifact: dict, log_prefix: str, end_phase):
+    """Make sure the artifact is in ARTIFACT_DIR with the expected checksum, uploading it only if not cached"""
+    name = artifact["name"]
+    check = f"echo '{artifact['sha256']}  {name}' | sha256sum -c --status"
+    output = run_command(
+        ws,
+        f"mkdir -p {ARTIFACT_DIR} && cd {ARTIFACT_DIR} && ({check} && echo AUTO_SHUTDOWN_CACHED"
+        " || echo AUTO_SHUTDOWN_UPLOAD); cd ~",
+        log_prefix,
+    )
+    if terminal_marker(output) == "CACHED":
+        logger.info(f"{log_prefix} Artifact {name} already cached")
+        return
+
+    logger.info(f"{log_prefix} Uploading artifact {name}")
+    # Uploaded under a temporary name through the contents API (relative to the home folder), then moved in place
+    # so that a partial upload is never mistaken for a cached artifact:
+    upload_resp = reqsess.put(
+        f"{api_base_url}/api/contents/{name}.upload",
+        params={"_xsrf": reqsess.cookies["_xsrf"]},
+        json={"type": "file", "format": "base64", "content": artifact["content"]},
+        timeout=HTTP_TIMEOUT,
+    )
+    upload_resp.raise_for_status()
+    output = run_command(
+        ws,
+        f"mv ~/{name}.upload {ARTIFACT_DIR}/{name} && cd {ARTIFACT_DIR} && {check} && echo AUTO_SHUTDOWN_VERIFIED;"
+        " cd ~",
+        log_prefix,
+    )
+    if terminal_marker(output) != "VERIFIED":
+        raise ValueError(f"Artifact {name} failed the checksum after upload")
+    end_phase("Upload")
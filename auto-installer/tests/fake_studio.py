@@ -0,0 +1,198 @@
+"""Local stand-in for the SageMaker Studio endpoints used by the auto-installer Lambda
+
+Serves, for any domain ID path prefix:
+- /<domain>/auth: the presigned login URL, setting the session cookies
+- /<domain>/app: the JupyterServer app status polled while it starts up
+- /<domain>/jupyter/default: the Jupyter landing page, setting the _xsrf cookie
+- /<domain>/jupyter/default/api/terminals: terminal creation
+- /<domain>/jupyter/default/api/contents/<path>: file uploads (PUT) to the profile's home folder
+- /<domain>/jupyter/default/sagemaker-studio-autoshutdown/idle_checker: the extension status, if installed
+- /<domain>/jupyter/default/terminals/websocket/<name>: a terminado-style terminal websocket
+
+The terminal speaks the terminado protocol: a ["setup", {}] message, then ["stdout", ...] messages with the command
+echo, its output and a bash prompt (split across two messages) for each ["stdin", ...] command. Command outputs are
+produced by a run_command(profile, command) callable, recording the commands of each profile. home(profile) is a
+temporary home folder for each profile, shared by the contents API and run_command.
+"""
+
+# Python Built-Ins:
+import asyncio
+import base64
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# External Dependencies:
+import tornado.ioloop
+import tornado.web
+import tornado.websocket
+
+PROMPT = "bash-4.2$ "
+RESTART_COMMAND_PREFIX = "nohup supervisorctl"
+
+
+class FakeStudio:
+    """Fake Studio server for a set of user profiles, run on a background thread
+
+    profiles maps user profile names to options:
+    - start_delay: seconds the JupyterServer app takes to start (logging in before that gives no _xsrf cookie)
+    - never_ready: the app stays Pending
+    - version: version of the extension reported by its status endpoint (not installed if missing)
+    """
+
+    def __init__(self, profiles: dict = None, run_command=None):
+        self.profiles = profiles or {}
+        self.run_command = run_command or (lambda profile, command: "")
+        self.commands = {}  # profile -> commands received, in order
+        self.started = {}  # profile -> time of the first login
+        self.uploads = {}  # profile -> paths uploaded through the contents API, in order
+        self.home_root = tempfile.mkdtemp(prefix="fake-studio-")
+        self.port = None
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        async def shutdown():
+            # close the kept-alive connections too, so that clients still running fail fast
+            self._server.stop()
+            await self._server.close_all_connections()
+            self._loop.stop()
+
+        self._loop.add_callback(shutdown)
+        shutil.rmtree(self.home_root, ignore_errors=True)
+
+    def login_url(self, domain_id: str, user_profile_name: str) -> str:
+        return f"http://127.0.0.1:{self.port}/{domain_id}/auth?token={user_profile_name}"
+
+    def home(self, profile: str) -> str:
+        path = os.path.join(self.home_root, profile)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def is_ready(self, profile: str) -> bool:
+        options = self.profiles.get(profile, {})
+        if options.get("never_ready"):
+            return False
+        return time.monotonic() - self.started.get(profile, 0) >= options.get("start_delay", 0)
+
+    def _serve(self):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        app = tornado.web.Application(
+            [
+                (r"/(\w[\w-]*)/auth", AuthHandler, {"studio": self}),
+                (r"/(\w[\w-]*)/app", AppHandler, {"studio": self}),
+                (r"/(\w[\w-]*)/jupyter/default", LandingHandler, {"studio": self}),
+                (r"/(\w[\w-]*)/jupyter/default/api/terminals", TerminalsHandler, {"studio": self}),
+                (r"/(\w[\w-]*)/jupyter/default/api/contents/(.+)", ContentsHandler, {"studio": self}),
+                (
+                    r"/(\w[\w-]*)/jupyter/default/sagemaker-studio-autoshutdown/idle_checker",
+                    ExtensionHandler,
+                    {"studio": self},
+                ),
+                (r"/(\w[\w-]*)/jupyter/default/terminals/websocket/(\w+)", TerminalHandler, {"studio": self}),
+            ]
+        )
+        self._server = app.listen(0, "127.0.0.1")
+        self.port = next(iter(self._server._sockets.values())).getsockname()[1]
+        self._loop = tornado.ioloop.IOLoop.current()
+        self._ready.set()
+        self._loop.start()
+
+
+class StudioHandler(tornado.web.RequestHandler):
+    def initialize(self, studio):
+        self.studio = studio
+
+    def check_xsrf_cookie(self):
+        pass
+
+    @property
+    def profile(self):
+        return self.get_cookie("profile")
+
+
+class AuthHandler(StudioHandler):
+    def get(self, domain_id):
+        profile = self.get_argument("token")
+        self.studio.started.setdefault(profile, time.monotonic())
+        self.set_cookie("profile", profile)
+        if self.studio.is_ready(profile):
+            self.set_cookie("_xsrf", "xsrf-" + profile)
+
+
+class AppHandler(StudioHandler):
+    def get(self, domain_id):
+        self.write("InService" if self.studio.is_ready(self.profile) else "Pending")
+
+
+class LandingHandler(StudioHandler):
+    def get(self, domain_id):
+        if self.studio.is_ready(self.profile):
+            self.set_cookie("_xsrf", "xsrf-" + self.profile)
+
+
+class TerminalsHandler(StudioHandler):
+    def post(self, domain_id):
+        if self.get_argument("_xsrf", None) != "xsrf-" + self.profile:
+            raise tornado.web.HTTPError(403)
+        self.write({"name": "1"})
+
+
+class ContentsHandler(StudioHandler):
+    def put(self, domain_id, path):
+        if self.get_argument("_xsrf", None) != "xsrf-" + self.profile:
+            raise tornado.web.HTTPError(403)
+        model = json.loads(self.request.body)
+        if model.get("type") != "file" or model.get("format") != "base64":
+            raise tornado.web.HTTPError(400)
+        with open(os.path.join(self.studio.home(self.profile), path), "wb") as f:
+            f.write(base64.b64decode(model["content"]))
+        self.studio.uploads.setdefault(self.profile, []).append(path)
+        self.set_status(201)
+        self.write({"name": os.path.basename(path), "path": path, "type": "file"})
+
+
+class ExtensionHandler(StudioHandler):
+    def get(self, domain_id):
+        version = self.studio.profiles.get(self.profile, {}).get("version")
+        if version is None:
+            raise tornado.web.HTTPError(404)
+        self.write({"version": version, "idle_time": 7200, "keep_terminals": False})
+
+
+class TerminalHandler(tornado.websocket.WebSocketHandler):
+    def initialize(self, studio):
+        self.studio = studio
+
+    def open(self, domain_id, name):
+        self.profile = self.get_cookie("profile")
+        self.write_message(json.dumps(["setup", {}]))
+        self.write_message(json.dumps(["stdout", "Welcome\r\n" + PROMPT]))
+
+    async def on_message(self, message):
+        stream, content = json.loads(message)
+        if stream != "stdin":
+            return
+        command = content.rstrip("\n")
+        self.studio.commands.setdefault(self.profile, []).append(command)
+        self.write_message(json.dumps(["stdout", command + "\r\n"]))
+        if command.startswith(RESTART_COMMAND_PREFIX):
+            # restarting the JupyterServer ends the terminal session
+            self.close()
+            return
+        output = await asyncio.get_event_loop().run_in_executor(
+            None, self.studio.run_command, self.profile, command
+        )
+        output = output.replace("\n", "\r\n")
+        # the prompt may be split across messages
+        self.write_message(json.dumps(["stdout", output + PROMPT[:5]]))
+        self.write_message(json.dumps(["stdout", PROMPT[5:]]))
@@ -0,0 +1,125 @@
+"""Tests of the auto-installer Lambda against a local fake Studio server (see fake_studio.py)"""
+
+# Python Built-Ins:
+import os
+import subprocess
+import sys
+
+# External Dependencies:
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "lambda"))
+sys.path.insert(0, HERE)
+# The SageMaker client is created at import, but only stand-ins are called
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+
+import main  # noqa: E402
+from fake_studio import FakeStudio  # noqa: E402
+
+
+class StubSageMaker:
+    def __init__(self, studio):
+        self.studio = studio
+
+    def create_presigned_domain_url(self, DomainId, UserProfileName):
+        return {"AuthorizedUrl": self.studio.login_url(DomainId, UserProfileName)}
+
+
+@pytest.fixture
+def studio(monkeypatch):
+    studio = FakeStudio({"cold": {"start_delay": 0.3}, "dead": {"never_ready": True}}).start()
+    monkeypatch.setattr(main, "smclient", StubSageMaker(studio))
+    monkeypatch.setattr(main, "READY_BACKOFF", (0.05, 0.1))
+    monkeypatch.setattr(main, "READY_TIMEOUT", 1)
+    monkeypatch.setattr(main, "COMMAND_TIMEOUT", 5)
+    monkeypatch.setattr(main, "HTTP_TIMEOUT", 5)
+    yield studio
+    studio.stop()
+
+
+def test_run_batch_from_repository(studio, monkeypatch):
+    monkeypatch.setattr(main, "load_artifact", lambda: None)
+
+    report = main.run_batch("d-test", ["alice", "bob", "cold", "dead"], max_workers=4)
+
+    assert (report["Succeeded"], report["Failed"], report["TimedOut"]) == (3, 1, 0)
+    results = {result["UserProfileName"]: result for result in report["Results"]}
+    for name in ("alice", "bob", "cold"):
+        assert results[name]["Status"] == "Succeeded"
+        assert studio.commands[name] == main.COMMAND_SCRIPT
+    assert set(results["alice"]["Phases"]) == {"Login", "Terminal", "Commands"}
+    # the cold app was polled until ready
+    assert set(results["cold"]["Phases"]) == {"Login", "Ready", "Terminal", "Commands"}
+    assert results["dead"]["Error"].startswith("TimeoutError")
+    assert "dead" not in studio.commands
+
+
+def test_run_batch_deadline(studio, monkeypatch):
+    monkeypatch.setattr(main, "load_artifact", lambda: None)
+
+    report = main.run_batch("d-test", ["dead", "alice"], max_workers=1, deadline=0)
+
+    assert report["TimedOut"] == 2
+
+
+@pytest.fixture
+def artifact(tmp_path, monkeypatch):
+    path = tmp_path / "sagemaker_studio_autoshutdown-9.9.9.tar.gz"
+    path.write_bytes(b"release artifact")
+    monkeypatch.setattr(main, "ENV_ARTIFACT_PATH", str(path))
+    monkeypatch.setattr(main, "ENV_ARTIFACT_SHA256", None)
+    main.load_artifact.cache_clear()
+    yield main.load_artifact()
+    main.load_artifact.cache_clear()
+
+
+@pytest.fixture
+def shell(studio, tmp_path):
+    """Run terminal commands in bash, in the profile's home folder, with stand-ins for the install tools"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for tool in ("pip", "jlpm", "jupyter"):
+        script = bin_dir / tool
+        script.write_text(f'#!/bin/bash\necho "{tool} $@"\nexit ${{FAKE_{tool.upper()}_STATUS:-0}}\n')
+        script.chmod(0o755)
+
+    def run_command(profile, command):
+        env = dict(os.environ, HOME=studio.home(profile), PATH=f"{bin_dir}:{os.environ['PATH']}")
+        if profile == "broken":
+            env["FAKE_PIP_STATUS"] = "1"
+        result = subprocess.run(["bash", "-c", command], env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return result.stdout.decode()
+
+    studio.run_command = run_command
+    return studio
+
+
+def test_run_batch_from_artifact(shell, artifact):
+    shell.profiles["current"] = {"version": "9.9.9"}
+    shell.profiles["outdated"] = {"version": "0.1.5"}
+
+    report = main.run_batch("d-test", ["alice", "current", "outdated", "broken"], max_workers=4)
+
+    assert (report["Succeeded"], report["Skipped"], report["Failed"]) == (2, 1, 1)
+    results = {result["UserProfileName"]: result for result in report["Results"]}
+    assert results["current"]["Status"] == "Skipped"
+    assert "current" not in shell.commands
+    for name in ("alice", "outdated"):
+        assert results[name]["Status"] == "Succeeded"
+        assert shell.uploads[name] == [artifact["name"] + ".upload"]
+        assert shell.commands[name][-1] == main.RESTART_COMMAND
+        installed = os.path.join(shell.home(name), ".auto-shutdown-artifacts", artifact["name"])
+        with open(installed, "rb") as f:
+            assert f.read() == b"release artifact"
+
+    # a failed install step stops the install before the JupyterServer restart
+    assert results["broken"]["Error"].startswith("RuntimeError: Install step failed")
+    assert "pip install" in results["broken"]["Error"]
+    assert not any(command.startswith("jupyter") for command in shell.commands["broken"])
+    assert main.RESTART_COMMAND not in shell.commands["broken"]
+
+    # the cached artifact is not uploaded again
+    report = main.run_batch("d-test", ["alice"])
+    assert report["Succeeded"] == 1
+    assert shell.uploads["alice"] == [artifact["name"] + ".upload"]
@@ -0,0 +1,153 @@
+"""
+Benchmark of IdleChecker.idle_checks against the local mock server.
+
+Starts benchmarks/mock_server.py in a child process for each fleet size, runs
+idle checks against it and reports, per tick, the median and p95 wall time,
+the CPU time and the peak memory allocated by the checker process. Results
+are compared with a stored baseline (benchmarks/baseline.json by default).
+
+Usage:
+    python benchmarks/bench_idle_checks.py [--fleet 1 100 1000 5000] [--ticks 20]
+    python benchmarks/bench_idle_checks.py --save-baseline
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import mock_server  # noqa: E402
+
+from sagemaker_studio_autoshutdown.idle_checker import IdleChecker  # noqa: E402
+
+BASELINE_FILE = os.path.join(HERE, "baseline.json")
+METRICS = ("wall_ms_p50", "wall_ms_p95", "cpu_ms", "alloc_peak_kib")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("mock server did not start on port {}".format(port))
+
+
+def make_checker(port, options):
+    checker = IdleChecker(state_file=None)
+    checker.app_url = "http://127.0.0.1:{}".format(port)
+    checker.base_url = "/"
+    checker.idle_time = options.idle_time
+    checker.log = logging.getLogger("bench")
+    return checker
+
+
+async def run_ticks(checker, ticks):
+    wall, cpu = [], []
+    for _ in range(ticks):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        await checker.idle_checks()
+        wall.append((time.perf_counter() - wall_start) * 1000)
+        cpu.append((time.process_time() - cpu_start) * 1000)
+    tracemalloc.start()
+    await checker.idle_checks()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    wall.sort()
+    return {
+        "wall_ms_p50": statistics.median(wall),
+        "wall_ms_p95": wall[min(len(wall) - 1, int(len(wall) * 0.95))],
+        "cpu_ms": statistics.median(cpu),
+        "alloc_peak_kib": peak / 1024.0,
+    }
+
+
+def bench_fleet(kernels, options):
+    port = free_port()
+    options.kernels = kernels
+    server = multiprocessing.Process(
+        target=mock_server.serve, args=(port, options), daemon=True
+    )
+    server.start()
+    try:
+        wait_for_port(port)
+        checker = make_checker(port, options)
+        return asyncio.run(run_ticks(checker, options.ticks))
+    finally:
+        server.terminate()
+        server.join()
+
+
+def compare(kernels, metrics, reference, tolerance):
+    regressions = []
+    print("{} kernels".format(kernels))
+    for name in METRICS:
+        value = metrics[name]
+        line = "  {:<16} {:10.2f}".format(name, value)
+        if reference.get(name):
+            change = value / reference[name] - 1
+            line += "  baseline {:10.2f}  {:+7.1%}".format(reference[name], change)
+            if change > tolerance:
+                regressions.append("{} kernels: {}".format(kernels, name))
+                line += "  REGRESSION"
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fleet", type=int, nargs="+", default=[1, 100, 1000, 5000])
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--idle-time", type=int, default=7200, help="idle time limit in seconds")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed slowdown over the baseline"
+    )
+    mock_server.add_arguments(parser)
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    baseline = {}
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    for kernels in options.fleet:
+        metrics = results[str(kernels)] = bench_fleet(kernels, options)
+        reference = baseline.get(str(kernels), {})
+        regressions += compare(kernels, metrics, reference, options.tolerance)
+
+    if options.save_baseline:
+        baseline.update(results)
+        with open(options.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print("Saved baseline to " + options.baseline)
+    elif regressions:
+        print("Regressions over {:.0%}: {}".format(options.tolerance, ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
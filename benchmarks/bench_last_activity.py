@@ -0,0 +1,73 @@
+"""
+Micro-benchmark of the kernel last_activity parsing done by IdleChecker.is_idle.
+
+Compares the previous datetime.strptime path with parse_last_activity, both
+on cold timestamps (every value distinct) and on the steady state where most
+kernels report the same last_activity as on the previous tick.
+
+Usage: python benchmarks/bench_last_activity.py [--kernels N] [--repeat R]
+"""
+
+import argparse
+import os
+import sys
+import time
+import timeit
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sagemaker_studio_autoshutdown.idle_checker import parse_last_activity  # noqa: E402
+
+
+def make_timestamps(count):
+    now = datetime.now(timezone.utc)
+    return [
+        (now - timedelta(seconds=i, microseconds=i)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        for i in range(count)
+    ]
+
+
+def strptime_elapsed(timestamps):
+    for value in timestamps:
+        last_activity = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fz")
+        (datetime.now() - last_activity).total_seconds()
+
+
+def cold_elapsed(timestamps):
+    parse_last_activity.cache_clear()
+    for value in timestamps:
+        time.time() - parse_last_activity(value)
+
+
+def warm_elapsed(timestamps):
+    for value in timestamps:
+        time.time() - parse_last_activity(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--kernels", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    timestamps = make_timestamps(args.kernels)
+    warm_elapsed(timestamps)
+
+    results = [
+        ("strptime", strptime_elapsed),
+        ("fromisoformat (cold)", cold_elapsed),
+        ("fromisoformat (memoized)", warm_elapsed),
+    ]
+    baseline = None
+    for name, func in results:
+        best = min(timeit.repeat(lambda: func(timestamps), number=1, repeat=args.repeat))
+        per_kernel = best / args.kernels * 1e6
+        baseline = baseline or per_kernel
+        print(
+            "{:<26} {:8.3f} us/kernel  x{:.1f}".format(name, per_kernel, baseline / per_kernel)
+        )
+
+
+if __name__ == "__main__":
+    main()
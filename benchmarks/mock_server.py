@@ -0,0 +1,185 @@
+"""
+Local stand-in for the Jupyter and SageMaker Studio APIs used by IdleChecker.
+
+Serves /tree, /api/sessions, /api/terminals, /sagemaker/api/apps and the
+kernel and app DELETE endpoints for a synthetic fleet, with optional
+injected latency and failures.
+
+Usage: python benchmarks/mock_server.py [--port 8888] [--kernels 1000] ...
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+
+import tornado.ioloop
+import tornado.web
+
+INSTANCE_TYPES = ("ml.t3.medium", "ml.m5.large", "ml.g4dn.xlarge", "ml.p3.2xlarge")
+
+
+class Fleet(object):
+    """Synthetic apps, kernel sessions and terminals of a Studio user."""
+
+    def __init__(
+        self,
+        kernels,
+        kernels_per_app=5,
+        terminals_per_app=1,
+        idle_age=60,
+        busy_fraction=0.1,
+        seed=0,
+    ):
+        rng = random.Random(seed)
+        now = datetime.now(timezone.utc)
+        self.apps = {}
+        self.sessions = {}
+        self.terminals = [{"name": "1", "last_activity": now.isoformat()}]
+        app_count = max(1, -(-kernels // kernels_per_app))
+        for i in range(app_count):
+            instance_type = INSTANCE_TYPES[i % len(INSTANCE_TYPES)]
+            environment_arn = "arn:aws:sagemaker:us-west-2:123456789012:image/img-{}".format(i)
+            app_name = "image-{}-{}-{:08x}".format(i, instance_type.replace(".", "-"), i)
+            self.apps[app_name] = {
+                "app_name": app_name,
+                "environment_arn": environment_arn,
+                "instance_type": instance_type,
+            }
+            for t in range(terminals_per_app):
+                terminal_id = "term-{}-{}".format(i, t)
+                self.terminals.append(
+                    {"name": "__".join((environment_arn, terminal_id, instance_type))}
+                )
+        app_names = list(self.apps)
+        for k in range(kernels):
+            kernel_id = "{:08x}-0000-0000-0000-{:012x}".format(k, k)
+            last_activity = now - timedelta(seconds=idle_age, microseconds=k)
+            self.sessions[kernel_id] = {
+                "id": "session-{}".format(k),
+                "path": "notebooks/nb-{}.ipynb".format(k),
+                "type": "notebook",
+                "kernel": {
+                    "id": kernel_id,
+                    "name": "python3",
+                    "app_name": app_names[k // kernels_per_app],
+                    "execution_state": "busy" if rng.random() < busy_fraction else "idle",
+                    "connections": rng.randint(0, 2),
+                    "last_activity": last_activity.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                },
+            }
+
+
+class MockHandler(tornado.web.RequestHandler):
+    def initialize(self, fleet, options):
+        self.fleet = fleet
+        self.options = options
+
+    async def prepare(self):
+        if self.options.latency_ms:
+            await asyncio.sleep(self.options.latency_ms / 1000.0)
+        if self.options.failure_rate and random.random() < self.options.failure_rate:
+            raise tornado.web.HTTPError(500)
+
+    def reply(self, payload):
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(payload))
+
+
+class TreeHandler(MockHandler):
+    def get(self):
+        self.set_cookie("_xsrf", "mock-xsrf-token")
+        self.finish("<html><body>tree</body></html>")
+
+
+class SessionsHandler(MockHandler):
+    def get(self):
+        self.reply(list(self.fleet.sessions.values()))
+
+
+class TerminalsHandler(MockHandler):
+    def get(self):
+        self.reply(self.fleet.terminals)
+
+
+class AppsHandler(MockHandler):
+    def get(self):
+        self.reply(list(self.fleet.apps.values()))
+
+
+class KernelHandler(MockHandler):
+    def delete(self, kernel_id):
+        if self.fleet.sessions.pop(kernel_id, None) is None:
+            raise tornado.web.HTTPError(404)
+        self.set_status(204)
+        self.finish()
+
+
+class AppHandler(MockHandler):
+    def delete(self, app_name):
+        if self.fleet.apps.pop(app_name, None) is None:
+            raise tornado.web.HTTPError(404)
+        self.set_status(204)
+        self.finish()
+
+
+def make_app(fleet, options):
+    kwargs = {"fleet": fleet, "options": options}
+    return tornado.web.Application(
+        [
+            (r"/tree", TreeHandler, kwargs),
+            (r"/api/sessions", SessionsHandler, kwargs),
+            (r"/api/terminals", TerminalsHandler, kwargs),
+            (r"/sagemaker/api/apps", AppsHandler, kwargs),
+            (r"/api/kernels/([^/]+)", KernelHandler, kwargs),
+            (r"/sagemaker/api/apps/([^/]+)", AppHandler, kwargs),
+        ]
+    )
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--kernels", type=int, default=1000, help="number of kernel sessions (1-5000)"
+    )
+    parser.add_argument("--kernels-per-app", type=int, default=5)
+    parser.add_argument("--terminals-per-app", type=int, default=1)
+    parser.add_argument(
+        "--idle-age", type=int, default=60, help="seconds since the kernels' last activity"
+    )
+    parser.add_argument("--busy-fraction", type=float, default=0.1)
+    parser.add_argument(
+        "--latency-ms", type=float, default=0.0, help="latency added to every request"
+    )
+    parser.add_argument(
+        "--failure-rate", type=float, default=0.0, help="fraction of requests answered with a 500"
+    )
+
+
+def serve(port, options):
+    if not 1 <= options.kernels <= 5000:
+        raise ValueError("--kernels must be between 1 and 5000")
+    fleet = Fleet(
+        options.kernels,
+        kernels_per_app=options.kernels_per_app,
+        terminals_per_app=options.terminals_per_app,
+        idle_age=options.idle_age,
+        busy_fraction=options.busy_fraction,
+    )
+    logging.getLogger("tornado.access").setLevel(logging.CRITICAL)
+    make_app(fleet, options).listen(port, address="127.0.0.1")
+    tornado.ioloop.IOLoop.current().start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8888)
+    add_arguments(parser)
+    options = parser.parse_args()
+    print("Serving {} kernels on http://127.0.0.1:{}/".format(options.kernels, options.port))
+    serve(options.port, options)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,4 +4,6 @@ import json
 session = requests.Session()
 get_response = session.get("http://localhost:8888/jupyter/default/sagemaker-studio-autoshutdown/idle_checker")
 print(get_response)
-print(get_response.json())
\ No newline at end of file
+print(get_response.json())
+health_response = session.get("http://localhost:8888/jupyter/default/sagemaker-studio-autoshutdown/health")
+print(health_response.json())
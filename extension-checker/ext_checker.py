@@ -1,55 +1,160 @@
-# Lambda Function for checking if auto shutdown extension was installed for every 
+# Lambda Function for checking if auto shutdown extension was installed for every
 # user profiles in each domain
 
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
 import boto3
 import requests
 
 DEFAULT_REGION = 'us-west-2'
+DEFAULT_CONCURRENCY = 16  # profiles probed in parallel
+DEFAULT_TIMEOUT = 10  # seconds, for each request of a probe
+TIME_LIMIT_MARGIN = 30  # seconds left to the Lambda function to report
+STUDIO_URL = 'https://{domain_id}.studio.{region}.sagemaker.aws/jupyter/default/'
+EXTENSION_PATH = 'sagemaker-studio-autoshutdown/idle_checker'
+
+
+# Function to list the user profiles of all domains, following NextToken
+def list_profiles(sagemaker):
+    profiles = []
+    kwargs = {}
+    while True:
+        response = sagemaker.list_user_profiles(**kwargs)
+        profiles.extend(response['UserProfiles'])
+        if not response.get('NextToken'):
+            return profiles
+        kwargs['NextToken'] = response['NextToken']
+
+
+# Function to create the report entry of a user profile
+def profile_result(domain_id, user_profile, status='error', error=None):
+    return {
+        'domain-id': domain_id,
+        'user-profile': user_profile,
+        'status': status,
+        'version': None,
+        'idle-time': None,
+        'keep-terminals': None,
+        'error': error,
+    }
+
+
+# Function to log in to the Studio of a user profile and query the extension
+def probe_profile(sagemaker, domain_id, user_profile, region, studio_url, timeout):
+    result = profile_result(domain_id, user_profile)
+    try:
+        presigned_url = sagemaker.create_presigned_domain_url(
+            DomainId=domain_id, UserProfileName=user_profile)
+
+        with requests.Session() as session:
+            session.get(presigned_url['AuthorizedUrl'], timeout=timeout)
+            response = session.get(
+                studio_url.format(domain_id=domain_id, region=region) + EXTENSION_PATH,
+                timeout=timeout)
+            if response.status_code != 200:
+                result['status'] = 'missing'
+                return result
+            data = response.json()
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        return result
+
+    result['status'] = 'installed'
+    # older versions of the extension do not report their version
+    result['version'] = data.get('version')
+    if data.get('idle_time') is not None:
+        result['idle-time'] = int(data['idle_time']) // 60  # convert to minutes
+    result['keep-terminals'] = data.get('keep_terminals')
+    return result
+
+
+# Function to probe all the user profiles with at most concurrency probes in flight.
+# Profiles not probed by the deadline (a time.time() value) are reported as errors.
+def check_profiles(sagemaker, region, studio_url=STUDIO_URL, concurrency=DEFAULT_CONCURRENCY,
+                   timeout=DEFAULT_TIMEOUT, deadline=None):
+    profiles = list_profiles(sagemaker)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    futures = [
+        executor.submit(probe_profile, sagemaker, profile['DomainId'],
+                        profile['UserProfileName'], region, studio_url, timeout)
+        for profile in profiles
+    ]
+    wait(futures, timeout=None if deadline is None else max(0, deadline - time.time()))
+    for future in futures:
+        future.cancel()
+    executor.shutdown(wait=False)
+
+    results = []
+    for profile, future in zip(profiles, futures):
+        if future.done() and not future.cancelled():
+            results.append(future.result())
+        else:
+            results.append(profile_result(profile['DomainId'], profile['UserProfileName'],
+                                          error='Not probed before the time limit'))
+    results.sort(key=lambda result: (result['domain-id'], result['user-profile']))
+
+    versions = {}
+    for result in results:
+        if result['status'] == 'installed':
+            version = result['version'] or 'unknown'
+            versions[version] = versions.get(version, 0) + 1
+    return {
+        'region': region,
+        'profiles': len(results),
+        'installed': sum(1 for result in results if result['status'] == 'installed'),
+        'missing': sum(1 for result in results if result['status'] == 'missing'),
+        'errors': sum(1 for result in results if result['status'] == 'error'),
+        'versions': versions,
+        'results': results,
+    }
+
 
 def lambda_handler(event, context):
-    
+
     region = event.get('region', DEFAULT_REGION)
     topic_arn = event.get('sns-topic')
-    
+
     sagemaker = boto3.client('sagemaker', region)
     sns = boto3.client('sns', region)
-    
+
+    deadline = None
+    if context is not None:
+        deadline = (time.time() + context.get_remaining_time_in_millis() / 1000.0
+                    - TIME_LIMIT_MARGIN)
+
     try:
-        
-        user_profiles = sagemaker.list_user_profiles()
-        no_ext_list = []
-        
-        for user in user_profiles['UserProfiles']:
-            domain_id = user['DomainId']
-            user_profile = user['UserProfileName']
-
-            presigned_url = sagemaker.create_presigned_domain_url(
-              DomainId=domain_id, UserProfileName=user_profile)
-        
-            session = requests.Session()
-            session.get(presigned_url['AuthorizedUrl'])
-            try:
-                response = session.get('https://{}.studio.{}.sagemaker.aws/jupyter/default/sagemaker-studio-autoshutdown/idle_checker'.format(domain_id, region))
-                ext_installed = True if response.status_code == 200 else False
-            except requests.exceptions.Timeout:
-                ext_installed = False
-            
-            if not ext_installed:
-                no_ext_list.append({'domain-id': domain_id, 'user-profile': user_profile})
-        
-        if len(no_ext_list) > 0:
-            payload = { 'profiles_with_no_auto_shutdown_ext': no_ext_list }
+
+        report = check_profiles(
+            sagemaker, region,
+            studio_url=event.get('studio-url', STUDIO_URL),
+            concurrency=int(event.get('concurrency', DEFAULT_CONCURRENCY)),
+            timeout=float(event.get('timeout', DEFAULT_TIMEOUT)),
+            deadline=deadline)
+
+        no_ext_list = [
+            {'domain-id': result['domain-id'], 'user-profile': result['user-profile']}
+            for result in report['results'] if result['status'] != 'installed'
+        ]
+
+        if len(no_ext_list) > 0 and topic_arn:
+            payload = {
+                'profiles_with_no_auto_shutdown_ext': no_ext_list,
+                'summary': {key: report[key] for key in
+                            ('region', 'profiles', 'installed', 'missing', 'errors', 'versions')},
+            }
             sns.publish(TargetArn=topic_arn, Message=json.dumps(payload))
-        
+
     except Exception as e:
         return {
             'statusCode': 500,
             'body': str(e)
         }
-    
-    
+
+
     return {
         'statusCode': 200,
-        'body': json.dumps('Auto-shutdown extension check complete')
+        'body': json.dumps(report)
     }
@@ -0,0 +1,122 @@
+# Tests of the extension checker against a stub SageMaker client and a local
+# stand-in for the Studio JupyterServer apps of the user profiles
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ext_checker  # noqa: E402
+
+# profile name -> (status code, JSON body or None, delay in seconds)
+PROFILES = {
+    'alice': (200, {'version': '0.1.5', 'idle_time': 7200, 'keep_terminals': False}, 0),
+    'bob': (200, {'version': '0.1.5', 'idle_time': 3600, 'keep_terminals': True}, 0),
+    'carol': (200, {'idle_time': 7200, 'keep_terminals': False}, 0),  # no version reported
+    'dave': (404, None, 0),
+    'erin': (503, None, 0),
+    'frank': (200, {'version': '0.1.5'}, 2),  # slower than the timeout
+}
+
+
+class StudioHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.endswith('/auth'):
+            profile = parse_qs(url.query)['profile'][0]
+            self.send_response(200)
+            self.send_header('Set-Cookie', 'profile={}; Path=/'.format(profile))
+            self.end_headers()
+            return
+        profile = self.headers.get('Cookie', '').partition('profile=')[2]
+        status, body, delay = PROFILES[profile]
+        time.sleep(delay)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(json.dumps(body).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class StubSageMaker(object):
+
+    def __init__(self, port, profiles, page_size=2):
+        self.port = port
+        self.profiles = profiles
+        self.page_size = page_size
+        self.list_calls = 0
+
+    def list_user_profiles(self, NextToken=None):
+        self.list_calls += 1
+        start = int(NextToken or 0)
+        page = self.profiles[start:start + self.page_size]
+        response = {'UserProfiles': [
+            {'DomainId': 'd-test', 'UserProfileName': name} for name in page
+        ]}
+        if start + self.page_size < len(self.profiles):
+            response['NextToken'] = str(start + self.page_size)
+        return response
+
+    def create_presigned_domain_url(self, DomainId, UserProfileName):
+        if UserProfileName == 'grace':
+            raise RuntimeError('AccessDenied')
+        return {'AuthorizedUrl': 'http://127.0.0.1:{}/{}/auth?profile={}'.format(
+            self.port, DomainId, UserProfileName)}
+
+
+@pytest.fixture
+def studio_port():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StudioHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_check_profiles_report(studio_port):
+    sagemaker = StubSageMaker(studio_port, sorted(PROFILES) + ['grace'])
+    report = ext_checker.check_profiles(
+        sagemaker, 'us-west-2',
+        studio_url='http://127.0.0.1:{}/{{domain_id}}/'.format(studio_port),
+        concurrency=4, timeout=0.5)
+
+    assert sagemaker.list_calls == 4  # 7 profiles, 2 per page
+    assert report['profiles'] == 7
+    assert report['installed'] == 3
+    assert report['missing'] == 2
+    assert report['errors'] == 2
+    assert report['versions'] == {'0.1.5': 2, 'unknown': 1}
+
+    results = {result['user-profile']: result for result in report['results']}
+    assert list(results) == sorted(results)
+    assert results['bob']['idle-time'] == 60
+    assert results['bob']['keep-terminals'] is True
+    assert results['carol']['version'] is None
+    assert results['frank']['status'] == 'error'
+    assert 'Timeout' in results['frank']['error']
+    assert results['grace']['error'] == 'RuntimeError: AccessDenied'
+
+
+def test_check_profiles_deadline(studio_port):
+    sagemaker = StubSageMaker(studio_port, ['frank'] * 4)
+    report = ext_checker.check_profiles(
+        sagemaker, 'us-west-2',
+        studio_url='http://127.0.0.1:{}/{{domain_id}}/'.format(studio_port),
+        concurrency=1, timeout=5, deadline=time.time() + 1)
+
+    assert report['errors'] == 4
+    assert sum(1 for result in report['results']
+               if result['error'] == 'Not probed before the time limit') >= 2
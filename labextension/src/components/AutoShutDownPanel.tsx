@@ -15,7 +15,7 @@
 import { IStateDB } from "@jupyterlab/coreutils";
 import { ReadonlyJSONObject } from "@phosphor/coreutils";
 import * as React from "react";
-import { requestAPIServer } from "../sagemaker-studio-autoshutdown";
+import { requestAPIServer, subscribeStatus } from "../sagemaker-studio-autoshutdown";
 import {
   runSidebarSectionClass,
   sidebarButtonClass,
@@ -41,6 +41,7 @@ interface PersistentState {
 
 interface IAutoShutDownPanelState extends PersistentState {
   alerts: (AlertProps & { key: string })[];
+  countdowns: { [appName: string]: number | null };
 }
 
 /** A React component for the autoshutdown extension's main display */
@@ -54,11 +55,22 @@ export class AutoShutDownPanel extends React.Component<
       IDLE_TIME: 120,
       keepTerminals: false,
       alerts: [],
+      countdowns: {},
     };
 
     this.loadState();
   }
 
+  componentDidMount(): void {
+    this.status = subscribeStatus(this.onStatus);
+  }
+
+  componentWillUnmount(): void {
+    if (this.status) {
+      this.status.close();
+    }
+  }
+
   /**
    * Renders the component.
    *
@@ -110,6 +122,14 @@ export class AutoShutDownPanel extends React.Component<
           ))}
         </div>
 
+        <div className={runSidebarSectionClass}>
+          {Object.keys(this.state.countdowns).map((appName) => (
+            <div key={`countdown-${appName}`} title={appName}>
+              {appName}: {this.formatCountdown(this.state.countdowns[appName])}
+            </div>
+          ))}
+        </div>
+
       </form>
     );
   }
@@ -165,6 +185,31 @@ export class AutoShutDownPanel extends React.Component<
     setInterval(() => this.clearAlerts(), 5000);
   };
 
+  private onStatus = (event: string, data: any): void => {
+    if (event === "countdown") {
+      this.setState({ countdowns: data.apps });
+    } else if (event === "warning") {
+      const apps = Object.keys(data.apps).map(
+        (appName) => `${appName} (${this.formatCountdown(data.apps[appName])})`
+      );
+      this.addAlert({ type: "alert", message: `Shutting down soon: ${apps.join(", ")}` });
+    } else if (event === "settings") {
+      this.setState({
+        IDLE_TIME: Number(data.idle_time) / 60,
+        keepTerminals: Boolean(data.keep_terminals),
+      });
+    }
+  };
+
+  private formatCountdown(seconds: number | null): string {
+    if (seconds === null) {
+      return "in use";
+    }
+    return `shutdown in ${Math.ceil(seconds / 60)} min`;
+  }
+
+  private status: EventSource;
+
   private alertKey = 0;
   private addAlert(alert: AlertProps) {
     const key = this.alertKey++;
@@ -51,3 +51,31 @@ export async function requestAPIServer<T>(
 
   return data;
 }
+
+/**
+ * Subscribe to the status stream of the API extension
+ *
+ * @param onEvent Callback receiving the event type and its parsed data
+ * @returns The underlying EventSource, to be closed by the caller
+ */
+export function subscribeStatus(
+  onEvent: (event: string, data: any) => void
+): EventSource {
+  const settings = ServerConnection.makeSettings();
+  let requestUrl = URLExt.join(
+    settings.baseUrl,
+    'sagemaker-studio-autoshutdown',
+    'events'
+  );
+  if (settings.token) {
+    requestUrl += '?token=' + encodeURIComponent(settings.token);
+  }
+
+  const source = new EventSource(requestUrl);
+  for (const event of ['tick', 'countdown', 'warning', 'settings']) {
+    source.addEventListener(event, (message: MessageEvent) => {
+      onEvent(event, JSON.parse(message.data));
+    });
+  }
+  return source;
+}
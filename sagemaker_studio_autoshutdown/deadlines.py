@@ -0,0 +1,83 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import heapq
+
+
+class DeadlineQueue(object):
+    """Min-heap of idle deadlines keyed by kernel id or app name.
+
+    Updating or removing a key is O(log n): the new entry is pushed and the old
+    one is left in the heap, to be skipped and discarded lazily. Listing the k
+    keys that are due only walks the part of the heap that is due, in O(k).
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def get(self, key):
+        return self._deadlines.get(key)
+
+    def keys(self):
+        return self._deadlines.keys()
+
+    def update(self, key, deadline):
+        if self._deadlines.get(key) == deadline:
+            return
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._compact()
+
+    def remove(self, key):
+        self._deadlines.pop(key, None)
+
+    def clear(self):
+        self._heap = []
+        self._deadlines = {}
+
+    # Function to return the earliest deadline, or None if the queue is empty
+    def peek(self):
+        heap = self._heap
+        while heap and self._deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    # Function to return the set of keys whose deadline is at or before now,
+    # without removing them. Children of an entry that is not due cannot be due
+    # either, so only the due part of the heap (and stale entries in it) is visited.
+    def due(self, now):
+        heap = self._heap
+        keys = set()
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            if i >= len(heap) or heap[i][0] > now:
+                continue
+            deadline, key = heap[i]
+            if self._deadlines.get(key) == deadline:
+                keys.add(key)
+            stack.append(2 * i + 1)
+            stack.append(2 * i + 2)
+        return keys
+
+    def _compact(self):
+        self._heap = [(deadline, key) for key, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
@@ -0,0 +1,62 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import asyncio
+import json
+
+
+class StatusBroadcaster(object):
+    """Fan-out of idle checker status events to Server-Sent Events subscribers.
+
+    Each event is serialized once and the same bytes are queued for every
+    subscriber, so the cost of a broadcast does not depend on the number of
+    open browser tabs. The last event of each type is replayed to new
+    subscribers. Subscribers that fall more than max_queue events behind are
+    disconnected.
+    """
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self._last = {}
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.max_queue)
+        for message in self._last.values():
+            queue.put_nowait(message)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    # Function to end a subscription, waking up the handler waiting on it
+    def close(self, queue):
+        self.unsubscribe(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def publish(self, event, data):
+        message = "event: {}\ndata: {}\n\n".format(
+            event, json.dumps(data, separators=(",", ":"))
+        ).encode()
+        self._last[event] = message
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.close(queue)
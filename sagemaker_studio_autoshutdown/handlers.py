@@ -11,14 +11,20 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+import asyncio
 import json
 
 import tornado
 import urllib3
 from notebook.base.handlers import APIHandler
 from notebook.utils import url_path_join
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
-from .idle_checker import IdleChecker
+from ._version import __version__
+from .idle_checker import IdleChecker, parse_log_level
+from .metrics import REGISTRY
+from .policies import PolicyTable
+from .prices import validate_prices
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 base_url = None
@@ -26,22 +32,207 @@ base_url = None
 idle_checker = IdleChecker()
 
 
+# Function to parse the settings posted to the settings handler into the
+# idle checker attributes to update. Raises TypeError or ValueError for
+# invalid settings, without changing the idle checker.
+def parse_settings(input_data, idle_checker):
+    if not isinstance(input_data, dict):
+        raise ValueError("Settings must be a JSON object")
+    settings = {}
+    if "idle_time" in input_data:
+        if isinstance(input_data["idle_time"], bool):
+            raise ValueError("idle_time must be a number of minutes")
+        settings["idle_time"] = int(input_data["idle_time"]) * 60  # convert to seconds
+        if settings["idle_time"] <= 0:
+            raise ValueError("idle_time must be positive")
+    for name in ("keep_terminals", "in_process", "shadow_mode", "record_snapshots"):
+        if name in input_data:
+            if not isinstance(input_data[name], bool):
+                raise ValueError("{} must be a boolean".format(name))
+            settings[name] = input_data[name]
+    interval = int(input_data.get("interval", idle_checker.interval))
+    max_interval = int(input_data.get("max_interval", idle_checker.max_interval))
+    if interval <= 0 or max_interval < interval:
+        raise ValueError("Invalid interval and max_interval")
+    settings["interval"] = interval
+    settings["max_interval"] = max_interval
+    if "tick_timeout" in input_data:
+        settings["tick_timeout"] = int(input_data["tick_timeout"])
+        if settings["tick_timeout"] <= 0:
+            raise ValueError("Invalid tick_timeout")
+    if "log_level" in input_data:
+        settings["log_level"] = parse_log_level(input_data["log_level"])
+    if "policies" in input_data:
+        settings["policies"] = PolicyTable(input_data["policies"] or [])
+    if "prices" in input_data:
+        settings["prices"] = validate_prices(input_data["prices"])
+    return settings
+
+
 class SettingsHandler(APIHandler):
     @tornado.web.authenticated
     async def post(self):
         global base_url
         global idle_checker
         input_data = self.get_json_body()
-        idle_checker.idle_time = int(input_data["idle_time"]) * 60  # convert to seconds
-        if "keep_terminals" in input_data:
-            idle_checker.keep_terminals = input_data["keep_terminals"]
+        # validate every setting before applying any, so that a rejected
+        # request leaves the idle checker unchanged
+        try:
+            settings = parse_settings(input_data, idle_checker)
+        except (TypeError, ValueError) as e:
+            raise tornado.web.HTTPError(400, str(e))
+        if "record_snapshots" in settings:
+            idle_checker.set_recording(settings.pop("record_snapshots"))
+        if "log_level" in settings:
+            idle_checker.set_log_level(settings.pop("log_level"))
+        if "prices" in settings:
+            idle_checker.set_prices(settings.pop("prices"))
+        for name, value in settings.items():
+            setattr(idle_checker, name, value)
         data = {
             "idle_time": str(idle_checker.idle_time),
             "keep_terminals": idle_checker.keep_terminals,
+            "log_level": idle_checker.log_level,
+            "in_process": idle_checker.in_process,
+            "shadow_mode": idle_checker.shadow_mode,
+            "record_snapshots": idle_checker.recorder is not None,
+            "policies": idle_checker.policies.rules,
+            "interval": idle_checker.interval,
+            "max_interval": idle_checker.max_interval,
+            "tick_timeout": idle_checker.tick_timeout,
         }
+        # run a check with the new settings instead of waiting for the next deadline
+        idle_checker.wake()
+        idle_checker.events.publish("settings", data)
         self.finish(json.dumps(data))
 
 
+class MetricsHandler(APIHandler):
+    # scrapes must not count as user activity of the server
+    _track_activity = False
+
+    @tornado.web.authenticated
+    async def get(self):
+        self.set_header("Content-Type", CONTENT_TYPE_LATEST)
+        self.write(generate_latest(REGISTRY))
+        # APIHandler.finish would replace the content type with application/json
+        tornado.web.RequestHandler.finish(self)
+
+
+class EventsHandler(APIHandler):
+    """Server-Sent Events stream of the idle checker status."""
+
+    # an open stream must not count as user activity of the server
+    _track_activity = False
+
+    keepalive = 30  # seconds between two comments keeping proxies from timing out
+
+    @tornado.web.authenticated
+    async def get(self):
+        global idle_checker
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        self.queue = idle_checker.events.subscribe()
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(self.queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    message = b": keepalive\n\n"
+                if message is None:
+                    break
+                self.write(message)
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            pass
+        finally:
+            idle_checker.events.unsubscribe(self.queue)
+
+    def on_connection_close(self):
+        global idle_checker
+
+        if getattr(self, "queue", None) is not None:
+            idle_checker.events.close(self.queue)
+
+
+class ForecastHandler(APIHandler):
+    """Idle deadlines computed by the last check, paginated and filterable by app name."""
+
+    # polling the forecast must not count as user activity of the server
+    _track_activity = False
+
+    max_limit = 1000
+
+    @tornado.web.authenticated
+    async def get(self):
+        global idle_checker
+
+        try:
+            offset = int(self.get_query_argument("offset", 0))
+            limit = int(self.get_query_argument("limit", 100))
+        except ValueError:
+            raise tornado.web.HTTPError(400, "Invalid offset or limit")
+        if offset < 0 or not 0 < limit <= self.max_limit:
+            raise tornado.web.HTTPError(400, "Invalid offset or limit")
+        app_names = set(self.get_query_arguments("app_name"))
+        self.finish(json.dumps(idle_checker.get_forecast(app_names, offset, limit)))
+
+
+class DecisionsHandler(APIHandler):
+    """Last deletions recorded by the idle checker in shadow mode."""
+
+    # reviewing the decisions must not count as user activity of the server
+    _track_activity = False
+
+    @tornado.web.authenticated
+    async def get(self):
+        global idle_checker
+
+        limit = self.get_query_argument("limit", None)
+        try:
+            limit = None if limit is None else int(limit)
+        except ValueError:
+            raise tornado.web.HTTPError(400, "Invalid limit")
+        if limit is not None and limit <= 0:
+            raise tornado.web.HTTPError(400, "Invalid limit")
+        self.finish(
+            json.dumps(
+                {
+                    "shadow_mode": idle_checker.shadow_mode,
+                    "decisions": idle_checker.get_decisions(limit),
+                }
+            )
+        )
+
+
+class CostsHandler(APIHandler):
+    """Estimated cost of the apps and dollars saved by shutting them down."""
+
+    # dashboards polling the costs must not count as user activity of the server
+    _track_activity = False
+
+    @tornado.web.authenticated
+    async def get(self):
+        global idle_checker
+
+        self.finish(json.dumps(idle_checker.get_costs()))
+
+
+class HealthHandler(APIHandler):
+    """Version and liveness of the idle checker, precomputed after each check."""
+
+    # fleet probes must not count as user activity of the server
+    _track_activity = False
+
+    @tornado.web.authenticated
+    async def get(self):
+        global idle_checker
+
+        self.set_header("Cache-Control", "no-store")
+        self.finish(idle_checker.health)
+
+
 class RouteHandler(APIHandler):
 
     # The following decorator should be present on all verb methods (head, get, post,
@@ -54,9 +245,13 @@ class RouteHandler(APIHandler):
         self.finish(
             json.dumps(
                 {
+                    "version": __version__,
                     "idle_time": idle_checker.idle_time,
                     "keep_terminals": idle_checker.keep_terminals,
-                    "count": idle_checker.get_runcounts()
+                    "count": idle_checker.get_runcounts(),
+                    "latency": idle_checker.get_tick_latency(),
+                    "summary": idle_checker.get_tick_summary(),
+                    "restarts": idle_checker.restarts,
                 }
             )
         )
@@ -66,7 +261,6 @@ class RouteHandler(APIHandler):
         global base_url
         global idle_checker
 
-        client = tornado.httpclient.AsyncHTTPClient()
         input_data = self.get_json_body()
         idle_time = int(input_data["idle_time"]) * 60  # convert to seconds
         # Get the value of keep_terminals -- New line
@@ -77,9 +271,7 @@ class RouteHandler(APIHandler):
                 "greetings": "Hello, from JupyterLab Sagemaker Studio AutoShutdown Extension!"
             }
             # start background job
-            idle_checker.start(
-                self.base_url, self.log, client, idle_time, keep_terminals
-            )
+            idle_checker.start(self.base_url, self.log, idle_time, keep_terminals)
             data["count"] = idle_checker.get_runcounts()
             self.finish(json.dumps(data))
         except Exception as e:
@@ -94,7 +286,23 @@ def setup_handlers(web_app, url_path):
     host_pattern = ".*$"
 
     base_url = web_app.settings["base_url"]
+    idle_checker.attach_managers(web_app.settings)
     route_pattern = url_path_join(base_url, url_path, "idle_checker")
     route_pattern2 = url_path_join(base_url, url_path, "settings")
-    handlers = [(route_pattern, RouteHandler), (route_pattern2, SettingsHandler)]
+    route_pattern3 = url_path_join(base_url, url_path, "metrics")
+    route_pattern4 = url_path_join(base_url, url_path, "events")
+    route_pattern5 = url_path_join(base_url, url_path, "forecast")
+    route_pattern6 = url_path_join(base_url, url_path, "decisions")
+    route_pattern7 = url_path_join(base_url, url_path, "costs")
+    route_pattern8 = url_path_join(base_url, url_path, "health")
+    handlers = [
+        (route_pattern, RouteHandler),
+        (route_pattern2, SettingsHandler),
+        (route_pattern3, MetricsHandler),
+        (route_pattern4, EventsHandler),
+        (route_pattern5, ForecastHandler),
+        (route_pattern6, DecisionsHandler),
+        (route_pattern7, CostsHandler),
+        (route_pattern8, HealthHandler),
+    ]
     web_app.add_handlers(host_pattern, handlers)
@@ -13,225 +13,1293 @@
  
 import asyncio
 import json
+import logging
+import os
+import random
 import time
 import traceback
+from collections import deque
 from contextlib import suppress
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
+ 
+from notebook.utils import maybe_future, url_path_join
+from tornado.httpclient import AsyncHTTPClient, HTTPError
+
+try:
+    # pycurl is optional; simple_httpclient does not keep connections alive
+    from tornado.curl_httpclient import CurlAsyncHTTPClient
+except ImportError:
+    CurlAsyncHTTPClient = None
+
+from ._version import __version__
+from .deadlines import DeadlineQueue
+from .events import StatusBroadcaster
+from .policies import Policy, PolicyTable
+from .metrics import (
+    APPS_EXAMINED_TOTAL,
+    DELETIONS_TOTAL,
+    DOLLARS_SAVED_TOTAL,
+    ERRORS_TOTAL,
+    IDLE_DOLLARS_BURNED_TOTAL,
+    KERNELS_EXAMINED_TOTAL,
+    LOOP_RESTARTS_TOTAL,
+    OLDEST_IDLE_KERNEL_AGE_SECONDS,
+    TICK_PHASE_DURATION_SECONDS,
+)
+from .prices import DEFAULT_PRICES, validate_prices
+from .snapshots import SnapshotRecorder
+
+
+# Function to parse an image terminal name of the form
+# "<environment_arn>__<terminal_id>__<instance_type>[__...]".
+# Returns None for system terminals and raises ValueError for malformed names.
+def parse_terminal_name(name):
+    if not isinstance(name, str) or name.find("arn:") != 0:
+        return None
+    parts = name.split("__")
+    if len(parts) < 3 or not all(parts[:3]):
+        raise ValueError("Malformed terminal name : %s" % name)
+    env_arn, terminal_id, instance_type = parts[:3]
+    return env_arn, terminal_id, instance_type
+
+
+# Function to normalize a log level name (e.g. "debug" to "DEBUG"), None
+# meaning inherit from the server log. Raises ValueError for unknown levels.
+def parse_log_level(level):
+    if level is None:
+        return None
+    levelno = logging.getLevelName(str(level).upper())
+    if not isinstance(levelno, int):
+        raise ValueError("Unknown log level: " + str(level))
+    return logging.getLevelName(levelno)
+
+
+# Function to convert a kernel last_activity timestamp (ISO-8601, UTC, e.g.
+# "2021-03-01T12:34:56.789012Z") to epoch seconds. Results are memoized as
+# last_activity of most kernels does not change between two ticks.
+@lru_cache(maxsize=4096)
+def parse_last_activity(last_activity):
+    if isinstance(last_activity, datetime):
+        # models read from the kernel manager carry datetimes, not strings
+        parsed = last_activity
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    value = last_activity
+    if value[-1:] in ("Z", "z"):
+        value = value[:-1] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        # fromisoformat only accepts 3 or 6 fraction digits before Python 3.11
+        parsed = datetime.strptime(last_activity, "%Y-%m-%dT%H:%M:%S.%fz")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
  
-from notebook.utils import url_path_join
+ 
+# Default location of the persisted in service apps, kept in the user's home
+# directory so that it survives JupyterServer app restarts
+STATE_FILE = os.path.join(
+    os.path.expanduser("~"), ".sagemaker-studio-autoshutdown", "inservice_apps.json"
+)
+DECISION_LOG = os.path.join(
+    os.path.expanduser("~"), ".sagemaker-studio-autoshutdown", "decisions.jsonl"
+)
+SNAPSHOT_FILE = os.path.join(
+    os.path.expanduser("~"), ".sagemaker-studio-autoshutdown", "snapshots.jsonl.gz"
+)
+PRICE_FILE = os.path.join(
+    os.path.expanduser("~"), ".sagemaker-studio-autoshutdown", "prices.json"
+)
  
  
 class IdleChecker(object):
-    def __init__(self):
-        self.interval = 10  # frequency for checking idle sessions in seconds
+    def __init__(
+        self, state_file=STATE_FILE, decision_log=DECISION_LOG, price_file=PRICE_FILE
+    ):
+        self.interval = 10  # shortest sleep between two checks in seconds
+        self.clock = time.time  # current time, replaced by a virtual clock in replays
+        self.monotonic = time.monotonic  # clock of the check loop heartbeat and its watchdog
         self._running = False
         self.count = 0
         self.task = None
         self.errors = None
         self.idle_time = 7200  # default idle time in seconds
         self.ignore_connections = True
-        self.tornado_client = None
+        self.tornado_client = None  # pooled HTTP client owned by the checker
+        self.max_clients = 10  # maximum number of concurrent requests of the client
+        self.connect_timeout = 2  # per-request connect timeout in seconds
+        self.request_timeout = 10  # per-request timeout of the deletes in seconds
+        self.list_request_timeout = 2  # per-request timeout of the listings, below fetch_timeout
+        self.max_retries = 2  # retries of requests failing with a 5xx or connection error
+        self.retry_backoff = 0.2  # base of the jittered exponential backoff in seconds
         self._xsrf_token = None
+        self._xsrf_lock = None  # lets concurrent deletes share one token fetch
         self.base_url = None
         self.app_url = "http://0.0.0.0:8888"
         self.keep_terminals = False
         self.inservice_apps = {}
+        self.fetch_timeout = 5  # per-source timeout of a listing call, retries included
+        self.tick_latency = {}  # per-phase latency of the last tick in seconds
+        self.tick_summary = {}  # counts of objects examined and deleted in the last tick
+        self.log = logging.getLogger(__name__)
+        self.log_level = None  # verbosity of the idle checker, None inherits from the server log
+        self._malformed_terminals = set()  # names of the malformed terminals already logged
+        self.in_process = False  # read kernels and terminals from the server managers
+        self.max_interval = 60  # longest sleep between two checks in seconds
+        self.next_deadline = None  # earliest time at which a kernel or app can become idle
+        self._check_soon = True  # run the next check after interval, e.g. after wake()
+        self.wakeup = None  # event set to run a check before the next deadline
+        self.kernel_manager = None
+        self.session_manager = None
+        self.terminal_manager = None
+        self.kernel_snapshots = {}  # kernel id -> state at the last check
+        self._snapshot_settings = None
+        self.kernel_deadlines = DeadlineQueue()  # kernel id -> idle deadline
+        self.kernel_idle_since = DeadlineQueue()  # kernel id with a deadline -> last activity
+        self.app_deadlines = DeadlineQueue()  # in service app name -> idle deadline
+        self.delete_concurrency = 8  # maximum number of concurrent delete requests
+        self.events = StatusBroadcaster()  # status stream of the events handler
+        self.warning_time = 300  # warn subscribers this many seconds before a shutdown
+        self.shutdown_deadlines = {}  # app name -> time it will be shut down, if idle
+        self._app_states = {}  # app name -> what its shutdown deadline depends on
+        self._changed_apps = set()  # apps whose shutdown deadline must be recomputed
+        self._warned = {}
+        self.apps_info = {}  # apps, sessions and terminals found by the last check
+        self.forecast = None  # per-app deadlines of the last check, built on demand
+        self.forecast_time = None
+        self.state_file = state_file  # None disables the persistence of inservice_apps
+        self._saved_inservice_apps = {}
+        self.shadow_mode = False  # record the deletions instead of running them
+        self.decisions = deque(maxlen=1000)  # last deletions recorded in shadow mode
+        self.decision_log = decision_log  # None disables the JSON Lines decision log
+        self._shadowed_apps = {}  # app name -> idle since (None with sessions), when recorded
+        self._shadowed_kernels = {}  # kernel id -> state when recorded in shadow mode
+        self.policies = PolicyTable()  # per-app overrides of the idle settings
+        self.app_policies = {}  # app name -> policy applied by the last check
+        self.snapshot_file = SNAPSHOT_FILE
+        self.recorder = None  # records the listings of each check for replays
+        self.prices = dict(DEFAULT_PRICES)  # instance type -> dollars per hour
+        self.price_file = price_file  # optional overrides of the default prices
+        self.app_prices = {}  # app name -> dollars per hour, None if unknown
+        self.savings_horizon = 8 * 3600  # how long a deleted idle app would have run
+        self.reclaimed_apps = {}  # deleted app name -> (dollars per hour, deleted at)
+        self.dollars_saved = 0.0
+        self.idle_dollars_burned = 0.0
+        self.hourly_cost = 0.0  # dollars per hour of the apps at the last check
+        self.idle_hourly_cost = 0.0  # same, for the apps without busy kernels
+        self.costs_since = None
+        self._last_accounting = None
+        self.last_tick = None  # time at which the last check completed
+        self.last_tick_duration = None  # duration of the last check in seconds
+        self.last_error = None  # exception class of the last failed check
+        self.last_error_time = None
+        self.tick_timeout = 300  # global deadline of a check in seconds
+        self.watchdog_task = None
+        self.watchdog_interval = 30  # seconds between two checks of the loop by the watchdog
+        self.restart_backoff = (1, 300)  # shortest and longest delay between two restarts in seconds
+        self.restarts = 0  # restarts of the check loop by the watchdog
+        self.last_heartbeat = None  # monotonic time at which the check loop last made progress
+        self._restart_delay = self.restart_backoff[0]
+        self._next_restart = 0  # monotonic time before which the loop is not restarted again
+        self.health = None  # JSON status of the health handler, updated after each check
+        self.update_health()
+        self.load_inservice_apps()
+        self.load_prices()
  
     # Function to GET the xsrf token
     async def fetch_xsrf_token(self):
         url = url_path_join(self.app_url, self.base_url, "tree")
-        self.log.info("URL: " + str(url))
-        response = await self.tornado_client.fetch(url, method="GET")
-        self.log.info("response headers: " + str(response.headers))
+        self.log.debug("Fetching xsrf token from %s", url)
+        response = await self.fetch(url)
+        self.log.debug("response headers: %s", response.headers)
         if "Set-Cookie" in response.headers:
             return response.headers["Set-Cookie"].split(";")[0].split("=")[1]
  
         return None
+
+    # Function to create the HTTP client used for the whole lifetime of the checker,
+    # with persistent connections when pycurl is available
+    def make_http_client(self):
+        if CurlAsyncHTTPClient is not None:
+            return CurlAsyncHTTPClient(force_instance=True, max_clients=self.max_clients)
+        return AsyncHTTPClient(force_instance=True, max_clients=self.max_clients)
+
+    # Function to send a request with the pooled client. Requests answered with a
+    # 5xx or failing to connect are retried with a jittered exponential backoff.
+    # request_timeout defaults to that of the deletes.
+    async def fetch(self, url, method="GET", headers=None, request_timeout=None):
+        if self.tornado_client is None:
+            self.tornado_client = self.make_http_client()
+        attempt = 0
+        while True:
+            try:
+                return await self.tornado_client.fetch(
+                    url,
+                    method=method,
+                    headers=headers,
+                    connect_timeout=self.connect_timeout,
+                    request_timeout=request_timeout or self.request_timeout,
+                )
+            except (HTTPError, OSError) as e:
+                transient = not isinstance(e, HTTPError) or e.code >= 500
+                if not transient or attempt >= self.max_retries:
+                    raise
+                delay = random.uniform(0, self.retry_backoff * 2 ** attempt)
+                attempt += 1
+                self.log.debug(
+                    "%s %s failed with %r, retry %d in %.2fs",
+                    method,
+                    url,
+                    e,
+                    attempt,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+
+    # Function to return the cached xsrf token, fetching it only when there is
+    # none or when it is still the rejected token. Concurrent callers wait for
+    # the fetch in progress instead of fetching /tree themselves.
+    async def get_xsrf_token(self, rejected=None):
+        if self._xsrf_lock is None:
+            self._xsrf_lock = asyncio.Lock()
+        async with self._xsrf_lock:
+            if self._xsrf_token is None or self._xsrf_token == rejected:
+                self._xsrf_token = await self.fetch_xsrf_token()
+            return self._xsrf_token
+
+    # Function to send a DELETE request with the cached xsrf token. The token is
+    # refreshed and the request retried once if the server rejects it with a 403.
+    async def delete_with_xsrf(self, url):
+        rejected = None
+        while True:
+            xsrf_token = await self.get_xsrf_token(rejected)
+            headers = {}
+            headers["X-Xsrftoken"] = xsrf_token
+            headers["Cookie"] = "_xsrf=" + xsrf_token
+            try:
+                return await self.fetch(url, method="DELETE", headers=headers)
+            except HTTPError as e:
+                if e.code != 403 or rejected is not None:
+                    raise
+                self.log.info("xsrf token rejected, refreshing it")
+                rejected = xsrf_token
  
     # Invoke idle_checks() function
     async def run_idle_checks(self):
         while True:
             self.count += 1
-            await asyncio.sleep(self.interval)
+            self.last_heartbeat = self.monotonic()
+            await self.sleep_until_next_check()
+            tick_start = self.last_heartbeat = self.monotonic()
             try:
-                self._xsrf_token = await self.fetch_xsrf_token()
-                await self.idle_checks()
-            except Exception:
+                # a check hanging on a slow request must not block the next ones
+                await asyncio.wait_for(self.idle_checks(), timeout=self.tick_timeout)
+            except asyncio.CancelledError:
+                # an Exception on Python 3.7, re-raised so that stop() ends the loop
+                raise
+            except Exception as e:
+                ERRORS_TOTAL.labels(type(e).__name__).inc()
                 self.errors = traceback.format_exc()
                 self.log.error(self.errors)
+                self.last_error = type(e).__name__
+                self.last_error_time = time.time()
+                self._check_soon = True
+            else:
+                self.last_tick = time.time()
+                self.last_tick_duration = self.monotonic() - tick_start
+                self._restart_delay = self.restart_backoff[0]
+            self.update_health()
+
+    # Function to return how long the check loop can go without progress
+    # before the watchdog considers it stalled: a full sleep and a check that
+    # runs up to its deadline, plus one watchdog interval of slack.
+    def stall_timeout(self):
+        return self.max_interval + self.tick_timeout + self.watchdog_interval
+
+    # Watchdog restarting the check loop when it died or stalled
+    async def watch(self):
+        while self._running:
+            await asyncio.sleep(self.watchdog_interval)
+            try:
+                self.check_loop()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                ERRORS_TOTAL.labels(type(e).__name__).inc()
+                self.log.exception("Watchdog check of the idle check loop failed")
+
+    # Function to restart the check loop if its task is done (it raised or was
+    # cancelled) or if it made no progress for stall_timeout() seconds. Restarts
+    # are spaced by an exponential backoff, reset by the next successful check.
+    def check_loop(self):
+        if not self._running:
+            return
+        now = self.monotonic()
+        if self.task is None or self.task.done():
+            reason = "dead"
+        elif now - self.last_heartbeat > self.stall_timeout():
+            reason = "stalled"
+        else:
+            return
+        if now < self._next_restart:
+            self.log.debug("Idle check loop %s, restart delayed by backoff", reason)
+            return
+
+        error = None
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        elif self.task is not None and not self.task.cancelled():
+            error = self.task.exception()
+        self.log.warning("Restarting the %s idle check loop", reason, exc_info=error)
+        self.restarts += 1
+        LOOP_RESTARTS_TOTAL.labels(reason).inc()
+        self._next_restart = now + self._restart_delay
+        self._restart_delay = min(self._restart_delay * 2, self.restart_backoff[1])
+        self.last_heartbeat = now
+        self.task = asyncio.ensure_future(self.run_idle_checks())
+        self.update_health()
+
+    # Function to precompute the status returned by the health handler, so that
+    # probing it costs no more than writing a constant string
+    def update_health(self):
+        self.health = json.dumps(
+            {
+                "version": __version__,
+                "running": self._running,
+                "restarts": self.restarts,
+                "last_tick": self.last_tick,
+                "last_tick_duration": self.last_tick_duration,
+                "last_error": self.last_error,
+                "last_error_time": self.last_error_time,
+            }
+        )
  
+    # Function to reload the in service apps persisted by a previous server process.
+    # Entries for apps that are gone are pruned by the first idle check.
+    def load_inservice_apps(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+            self.inservice_apps = {
+                str(app_name): float(since) for app_name, since in state.items()
+            }
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            self.log.warning("Ignoring unreadable state file %s: %r", self.state_file, e)
+            return
+        self._saved_inservice_apps = dict(self.inservice_apps)
+        self.log.info("Loaded %d in service apps from %s", len(self.inservice_apps), self.state_file)
+
+    # Function to persist the in service apps if they changed since the last save.
+    # The file is written next to its final location and atomically replaced.
+    def save_inservice_apps(self):
+        if not self.state_file or self.inservice_apps == self._saved_inservice_apps:
+            return
+        tmp_file = self.state_file + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            with open(tmp_file, "w") as f:
+                json.dump(
+                    {name: int(since) for name, since in self.inservice_apps.items()},
+                    f,
+                    separators=(",", ":"),
+                )
+            os.replace(tmp_file, self.state_file)
+        except OSError as e:
+            self.log.warning("Failed to save state file %s: %r", self.state_file, e)
+            return
+        self._saved_inservice_apps = dict(self.inservice_apps)
+
+    # Function to load the price overrides of price_file, if any
+    def load_prices(self):
+        if not self.price_file or not os.path.exists(self.price_file):
+            return
+        try:
+            with open(self.price_file) as f:
+                self.set_prices(json.load(f))
+        except (OSError, ValueError) as e:
+            self.log.warning("Ignoring unreadable price file %s: %r", self.price_file, e)
+            return
+        self.log.info("Loaded prices from %s", self.price_file)
+
+    # Function to override the hourly price of some instance types, raises
+    # ValueError for invalid prices
+    def set_prices(self, prices):
+        self.prices.update(validate_prices(prices))
+
+    # Function to return the number of seconds to sleep before the next check.
+    # The checker wakes up at the earliest idle deadline, bounded by interval
+    # and max_interval. Apps that lose their last session are only noticed on
+    # the next check, so max_interval bounds how late their shutdown can be.
+    # Without any deadline the checker sleeps max_interval, unless the next
+    # check was requested by wake() or the last one was skipped or failed.
+    def next_interval(self):
+        if self._check_soon:
+            return self.interval
+        if self.next_deadline is None:
+            return self.max_interval
+        delay = self.next_deadline - self.clock()
+        return min(max(delay, self.interval), self.max_interval)
+
+    # Function to sleep until the next check is due or wake() is called
+    async def sleep_until_next_check(self):
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self.wakeup.wait(), timeout=self.next_interval())
+        self.wakeup.clear()
+
+    # Function to run the next check right away, e.g. after a settings change
+    def wake(self):
+        self.next_deadline = None
+        self._check_soon = True
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    # Function to attach the kernel, session and terminal managers of the Jupyter server
+    def attach_managers(self, settings):
+        self.kernel_manager = settings.get("kernel_manager")
+        self.session_manager = settings.get("session_manager")
+        self.terminal_manager = settings.get("terminal_manager")
+
     # Entrypoint function to get the value from handlers(POST API call) and start background job
-    def start(self, base_url, log_handler, client, idle_time, keep_terminals):
+    def start(self, base_url, log_handler, idle_time, keep_terminals):
         self.idle_time = idle_time
-        self.tornado_client = client
         self.base_url = base_url
-        self.log = log_handler
+        # use a child of the server logger so that its level can be tuned separately
+        self.log = log_handler.getChild("idle_checker")
+        self.log.setLevel(self.log_level or logging.NOTSET)
         self.keep_terminals = keep_terminals
         self.errors = None  # clear error array at start
  
         if not self._running:
             self.count += 1
             self._running = True
+            self.last_heartbeat = self.monotonic()
             self.task = asyncio.ensure_future(self.run_idle_checks())
+            self.watchdog_task = asyncio.ensure_future(self.watch())
+            self.update_health()
+        else:
+            # the loop may have died since it was started
+            self.check_loop()
+            # idle_time may have changed, recompute the deadlines now
+            self.wake()
  
     async def stop(self):
         if self._running:
             self._running = False
-            if self.task:
-                self.task.cancel()
-                with suppress(asyncio.CancelledError):
-                    await self.task
+            for task in (self.watchdog_task, self.task):
+                if task:
+                    task.cancel()
+                    # a dead loop raises its own exception, already reported
+                    with suppress(asyncio.CancelledError, Exception):
+                        await task
+            self.watchdog_task = None
+            if self.tornado_client is not None:
+                self.tornado_client.close()
+                self.tornado_client = None
+            self.update_health()
  
     def get_runcounts(self):
         return self.count
  
     def get_runerrors(self):
         return self.errors
+
+    def get_tick_latency(self):
+        return self.tick_latency
+
+    def get_tick_summary(self):
+        return self.tick_summary
+
+    # Function to start or stop recording the listings of each check to
+    # snapshot_file, to be replayed offline with sagemaker_studio_autoshutdown.replay
+    def set_recording(self, enabled):
+        if enabled and self.recorder is None:
+            os.makedirs(os.path.dirname(self.snapshot_file), exist_ok=True)
+            self.recorder = SnapshotRecorder(self.snapshot_file, self.log)
+        elif not enabled and self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    # Function to replace the policy table, raises ValueError for invalid rules
+    def set_policies(self, rules):
+        self.policies = PolicyTable(rules)
+
+    # Function to return the idle settings applied to an app: those of the first
+    # matching policy, completed with the current global settings. The matching
+    # policy is cached by the table, the global settings are read every time.
+    def policy_for(self, app):
+        return self.resolve_policy(
+            app.get("app_name"), app.get("environment_arn"), app.get("instance_type")
+        )
+
+    # Function to complete the first policy matching an app with the global settings
+    def resolve_policy(self, app_name, environment_arn, instance_type):
+        policy = self.policies.lookup(app_name, environment_arn, instance_type)
+        if policy is None:
+            return self.default_policy()
+        return Policy(
+            policy.name,
+            self.idle_time if policy.idle_time is None else policy.idle_time,
+            self.ignore_connections
+            if policy.ignore_connections is None
+            else policy.ignore_connections,
+            self.keep_terminals if policy.keep_terminals is None else policy.keep_terminals,
+        )
+
+    # Function to return the global idle settings as a policy
+    def default_policy(self):
+        return Policy("default", self.idle_time, self.ignore_connections, self.keep_terminals)
+
+    # Function to change the verbosity of the idle checker at runtime
+    def set_log_level(self, level):
+        self.log_level = parse_log_level(level)
+        self.log.setLevel(self.log_level or logging.NOTSET)
+
+    # Function to log one summary record per tick
+    def log_tick_summary(self):
+        self.log.info(
+            "Idle check #%d: %d apps, %d sessions (%d re-evaluated), %d terminals "
+            "examined; %d kernels and %d apps deleted, %d deletions failed in %.3fs; "
+            "took %.3fs",
+            self.count,
+            self.tick_summary["apps"],
+            self.tick_summary["sessions"],
+            self.tick_summary["kernels_evaluated"],
+            self.tick_summary["terminals"],
+            self.tick_summary["kernels_deleted"],
+            self.tick_summary["apps_deleted"],
+            self.tick_summary["deletes_failed"],
+            self.tick_latency["delete"],
+            self.tick_latency["total"],
+        )
  
     # Function to check if the notebook is in Idle state
-    def is_idle(self, last_activity, seconds=False):
-        last_activity = datetime.strptime(last_activity, "%Y-%m-%dT%H:%M:%S.%fz")
-        self.log.info(
-            "comparing idle time limit "
-            + str(self.idle_time)
-            + " and elapsed time "
-            + str((datetime.now() - last_activity).total_seconds())
+    def is_idle(self, last_activity, seconds=False, idle_time=None):
+        if idle_time is None:
+            idle_time = self.idle_time
+        elapsed = self.clock() - parse_last_activity(last_activity)
+        idle = elapsed > idle_time
+        self.log.debug(
+            "Notebook idle = %s. Last activity time = %s, elapsed time %.0fs, idle time limit %ss",
+            idle,
+            last_activity,
+            elapsed,
+            idle_time,
         )
-        if (datetime.now() - last_activity).total_seconds() > self.idle_time:
-            self.log.info(
-                "Notebook is idle. Last activity time = " + str(last_activity)
-            )
-            return True
-        else:
-            self.log.info(
-                "Notebook is not idle. Last activity time = " + str(last_activity)
-            )
-            return False
+        return idle
  
     # Function to get the list of Kernel sessions
     async def get_sessions(self):
+        if self.in_process and self.session_manager is not None:
+            sessions = await maybe_future(self.session_manager.list_sessions())
+            self.log.debug("Kernel sessions = %s", sessions)
+            return sessions
         url = url_path_join(self.app_url, self.base_url, "api", "sessions")
-        response = await self.tornado_client.fetch(url, method="GET")
+        response = await self.fetch(url, request_timeout=self.list_request_timeout)
         sessions = json.loads(response.body)
-        self.log.info(" Kernel Session is = " + str(sessions))
+        self.log.debug("Kernel sessions = %s", sessions)
         return sessions
  
     # Function to get the list of System Terminals
     async def get_terminals(self):
+        if self.in_process and self.terminal_manager is not None:
+            return await maybe_future(self.terminal_manager.list())
         terminal_url = url_path_join(self.app_url, self.base_url, "api", "terminals")
-        terminal_response = await self.tornado_client.fetch(terminal_url, method="GET")
+        terminal_response = await self.fetch(
+            terminal_url, request_timeout=self.list_request_timeout
+        )
         terminals = json.loads(terminal_response.body)
         return terminals
  
     # Function to get the list of running Apps
     async def get_apps(self):
         url = url_path_join(self.app_url, self.base_url, "sagemaker", "api", "apps")
-        response = await self.tornado_client.fetch(url, method="GET")
+        response = await self.fetch(url, request_timeout=self.list_request_timeout)
         apps = json.loads(response.body)
-        self.log.info(" Running App name is = " + str(apps))
+        self.log.debug("Running apps = %s", apps)
         return apps
  
+    # Function to await a listing call with a timeout and record its latency.
+    # fetch_timeout bounds the whole call, retries included: with listing
+    # requests timing out after list_request_timeout, a slow request is
+    # retried at least once before the listing is given up.
+    async def timed_fetch(self, name, fetch):
+        start = time.monotonic()
+        try:
+            return await asyncio.wait_for(fetch(), timeout=self.fetch_timeout)
+        finally:
+            self.tick_latency[name] = time.monotonic() - start
+
     # Function to build app information ( kernel sessions and image terminals)
+    # Returns None when any of the listings failed, so that no destructive
+    # decision is taken on a partial view of the server.
     async def build_app_info(self):
-        apps = await self.get_apps()
+        start = time.monotonic()
+        sources = ("apps", "sessions", "terminals")
+        results = await asyncio.gather(
+            self.timed_fetch("apps", self.get_apps),
+            self.timed_fetch("sessions", self.get_sessions),
+            self.timed_fetch("terminals", self.get_terminals),
+            return_exceptions=True,
+        )
+        self.tick_latency["fetch"] = time.monotonic() - start
+
+        failed = False
+        for source, result in zip(sources, results):
+            if isinstance(result, BaseException):
+                failed = True
+                ERRORS_TOTAL.labels(type(result).__name__).inc()
+                self.errors = "Failed to list " + source + ": " + repr(result)
+                self.log.error(self.errors)
+        if failed:
+            return None
+        apps, sessions, terminals = results
+        if self.recorder is not None:
+            self.recorder.record(self.clock(), apps, sessions, terminals)
+
         apps_info = {}
         for app in apps:
             apps_info[app["app_name"]] = {"app": app, "sessions": [], "terminals": []}
  
-        sessions = await self.get_sessions()
         for notebook in sessions:
             if notebook["kernel"]:
                 notebook_app_name = notebook["kernel"]["app_name"]
-                apps_info[notebook_app_name]["sessions"].append(notebook)
+                if notebook_app_name in apps_info:
+                    apps_info[notebook_app_name]["sessions"].append(notebook)
  
-        terminals = await self.get_terminals()
+        # index apps by (environment_arn, instance_type) to match image terminals
+        apps_index = {}
+        for app in apps:
+            apps_index.setdefault(
+                (app["environment_arn"], app["instance_type"]), app["app_name"]
+            )
+
         for terminal in terminals:
-            if terminal["name"].find("arn:") != 0:
+            try:
+                parsed = parse_terminal_name(terminal["name"])
+            except ValueError as e:
+                self.tick_summary["malformed_terminals"] += 1
+                # the same terminal is listed again every tick, warn about it once
+                if terminal["name"] not in self._malformed_terminals:
+                    self._malformed_terminals.add(terminal["name"])
+                    self.log.warning("%s", e)
                 continue
-                
-            env_arn, terminal_id, instance_type, *other = terminal["name"].split("__")
-            
-            self.log.info("Env Arn = " + str(env_arn))
-            self.log.info("Terminal Id = " + str(terminal_id))
-            self.log.info("Instance Type = "+ str(instance_type))
- 
-            for app in apps:
-                if (
-                    app["environment_arn"] == env_arn
-                    and app["instance_type"] == instance_type
-                ):
-                    apps_info[app["app_name"]]["terminals"].append(terminal)
-                    break
+            if parsed is None:
+                continue
+            env_arn, terminal_id, instance_type = parsed
+
+            self.log.debug(
+                "Terminal Id = %s, Env Arn = %s, Instance Type = %s",
+                terminal_id,
+                env_arn,
+                instance_type,
+            )
+
+            app_name = apps_index.get((env_arn, instance_type))
+            if app_name is not None:
+                apps_info[app_name]["terminals"].append(terminal)
  
-        self.log.info(str(apps_info))
+        self.log.debug("App info = %s", apps_info)
         return apps_info
  
     # Function to delete a kernel session
     async def delete_session(self, session):
-        headers = {}
-        headers["X-Xsrftoken"] = self._xsrf_token
-        headers["Cookie"] = "_xsrf=" + self._xsrf_token
         kernel_id = session["kernel"]["id"]
-        self.log.info("deleting kernel : " + str(kernel_id))
-        url = url_path_join(
-            self.app_url, self.base_url, "api", "kernels", str(kernel_id)
-        )
-        deleted = await self.tornado_client.fetch(url, method="DELETE", headers=headers)
-        self.log.info("Delete kernel response: " + str(deleted))
+        self.log.info("deleting kernel : %s", kernel_id)
+        if self.in_process and self.kernel_manager is not None:
+            deleted = await maybe_future(self.kernel_manager.shutdown_kernel(kernel_id))
+        else:
+            url = url_path_join(
+                self.app_url, self.base_url, "api", "kernels", str(kernel_id)
+            )
+            deleted = await self.delete_with_xsrf(url)
+        self.log.debug("Delete kernel response: %s", deleted)
+        self.tick_summary["kernels_deleted"] += 1
+        self.kernel_snapshots.pop(kernel_id, None)
+        self.kernel_deadlines.remove(kernel_id)
+        self.kernel_idle_since.remove(kernel_id)
+        DELETIONS_TOTAL.labels("kernel", "success").inc()
  
     # Function to delete an application
     async def delete_application(self, app_id):
-        headers = {}
-        headers["X-Xsrftoken"] = self._xsrf_token
-        headers["Cookie"] = "_xsrf=" + self._xsrf_token
-        self.log.info("deleting app : " + str(app_id))
+        self.log.info("deleting app : %s", app_id)
         url = url_path_join(
             self.app_url, self.base_url, "sagemaker", "api", "apps", str(app_id)
         )
-        deleted_apps = await self.tornado_client.fetch(
-            url, method="DELETE", headers=headers
-        )
-        self.log.info("Delete App response: " + str(deleted_apps))
+        deleted_apps = await self.delete_with_xsrf(url)
+        self.log.debug("Delete App response: %s", deleted_apps)
         if deleted_apps.code == 204 or deleted_apps.code == 200:
+            self.reclaimed_apps[app_id] = (self.app_prices.get(app_id) or 0.0, self.clock())
             self.inservice_apps.pop(app_id, None)
+            self.tick_summary["apps_deleted"] += 1
+            DELETIONS_TOTAL.labels("app", "success").inc()
  
     # Function to check the notebook status
-    def check_notebook(self, notebook):
+    def check_notebook(self, notebook, policy=None):
+        policy = policy or self.default_policy()
         terminate = True
         if notebook["kernel"]["execution_state"] in ("idle", "starting"):
-            self.log.info("found idle/starting session:" + str(notebook))
-            if not self.ignore_connections:
+            self.log.debug("found idle/starting session: %s", notebook)
+            if not policy.ignore_connections:
                 if notebook["kernel"]["connections"] == 0:
-                    if not self.is_idle(notebook["kernel"]["last_activity"]):
+                    if not self.is_idle(
+                        notebook["kernel"]["last_activity"], idle_time=policy.idle_time
+                    ):
                         terminate = False
                 else:
                     terminate = False
             else:
-                if not self.is_idle(notebook["kernel"]["last_activity"]):
+                if not self.is_idle(
+                    notebook["kernel"]["last_activity"], idle_time=policy.idle_time
+                ):
                     terminate = False
         else:
             terminate = False
         return terminate
+
+    # Function to return the time at which a kernel reaches the idle time limit, or
+    # None for busy or connected kernels, which have no deadline until their state
+    # changes
+    def kernel_deadline(self, kernel, policy=None):
+        policy = policy or self.default_policy()
+        if kernel["execution_state"] not in ("idle", "starting"):
+            return None
+        if not policy.ignore_connections and kernel["connections"] != 0:
+            return None
+        return parse_last_activity(kernel["last_activity"]) + policy.idle_time
+
+    # Function to diff the kernels of this tick against the snapshots of the
+    # previous one. Snapshots of removed kernels are dropped, and all of them
+    # when the idle settings, the policies or the shadow mode changed since they
+    # were taken.
+    def diff_kernels(self, apps_info):
+        settings = (
+            self.idle_time,
+            self.ignore_connections,
+            self.shadow_mode,
+            self.policies,
+        )
+        if settings != self._snapshot_settings:
+            self.kernel_snapshots = {}
+            self.kernel_deadlines.clear()
+            self.kernel_idle_since.clear()
+            self.app_deadlines.clear()
+            self._shadowed_apps = {}
+            self._shadowed_kernels = {}
+            self._snapshot_settings = settings
+        kernel_ids = set()
+        for app in apps_info.values():
+            for notebook in app["sessions"]:
+                kernel_ids.add(notebook["kernel"]["id"])
+        removed = self.kernel_snapshots.keys() - kernel_ids
+        for kernel_id in removed:
+            del self.kernel_snapshots[kernel_id]
+            self.kernel_deadlines.remove(kernel_id)
+            self.kernel_idle_since.remove(kernel_id)
+            self._shadowed_kernels.pop(kernel_id, None)
+        self.tick_summary["kernels_new"] = len(kernel_ids - self.kernel_snapshots.keys())
+        self.tick_summary["kernels_removed"] = len(removed)
+
+    # Function to check the notebook status, re-evaluating it only if the kernel
+    # is new, changed since the last tick, or in the set of due kernels
+    def check_notebook_changed(self, notebook, due_kernels, policy=None):
+        kernel = notebook["kernel"]
+        state = (kernel["execution_state"], kernel["connections"], kernel["last_activity"])
+        snapshot = self.kernel_snapshots.get(kernel["id"])
+        if snapshot is not None:
+            if snapshot != state:
+                self.tick_summary["kernels_changed"] += 1
+            elif kernel["id"] not in due_kernels:
+                return False
+        self.tick_summary["kernels_evaluated"] += 1
+        self.kernel_snapshots[kernel["id"]] = state
+        deadline = self.kernel_deadline(kernel, policy)
+        if deadline is None:
+            self.kernel_deadlines.remove(kernel["id"])
+            self.kernel_idle_since.remove(kernel["id"])
+        else:
+            self.kernel_deadlines.update(kernel["id"], deadline)
+            self.kernel_idle_since.update(
+                kernel["id"], parse_last_activity(kernel["last_activity"])
+            )
+        return self.check_notebook(notebook, policy)
+
+    # Function to tell whether a kernel was recorded in shadow mode and has not
+    # changed since, i.e. whether it would be gone if the checker were not in
+    # shadow mode
+    def is_shadowed_kernel(self, notebook):
+        kernel = notebook["kernel"]
+        recorded = self._shadowed_kernels.get(kernel["id"])
+        state = (kernel["execution_state"], kernel["connections"], kernel["last_activity"])
+        return recorded is not None and recorded == state
+
+    # Function to forget when an app was first seen without kernel sessions (or
+    # with only image terminals), once it has sessions or kept terminals again
+    def unregister_inservice_app(self, app_name):
+        if self.inservice_apps.pop(app_name, None) is not None:
+            self.log.debug("inservice app in use again : %s", app_name)
+        self.app_deadlines.remove(app_name)
+
+    # Function to bring the idle deadlines of the in service apps up to date
+    # Apps already recorded in shadow mode get no deadline until they change.
+    def sync_app_deadlines(self):
+        for app_name in list(self.app_deadlines.keys()):
+            if app_name not in self.inservice_apps:
+                self.app_deadlines.remove(app_name)
+        for app_name in list(self._shadowed_apps):
+            if self._shadowed_apps[app_name] != self.inservice_apps.get(app_name):
+                del self._shadowed_apps[app_name]
+        for app_name, since in self.inservice_apps.items():
+            if app_name in self._shadowed_apps:
+                self.app_deadlines.remove(app_name)
+            else:
+                policy = self.app_policies.get(app_name) or self.default_policy()
+                self.app_deadlines.update(app_name, since + policy.idle_time)
+
+    # Function to return the earliest time at which a kernel or an in service app
+    # can reach the idle time limit. Busy or connected kernels have no deadline
+    # until their state changes, which can only push the deadline further away.
+    def earliest_deadline(self):
+        deadlines = [self.kernel_deadlines.peek(), self.app_deadlines.peek()]
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        return min(deadlines) if deadlines else None
+
+    # Function to update when each app will be shut down if it stays idle, or None
+    # while one of its kernels is busy or its terminals are kept. Only the apps
+    # changed by this check are recomputed, the deadlines of the others still hold.
+    def update_shutdown_deadlines(self, apps_info):
+        now = self.clock()
+        deadlines = self.shutdown_deadlines
+        for app_name in deadlines.keys() - apps_info.keys():
+            del deadlines[app_name]
+        for app_name in self._changed_apps:
+            app = apps_info.get(app_name)
+            if app is None:
+                continue
+            policy = self.app_policies.get(app_name) or self.default_policy()
+            if app["terminals"] and policy.keep_terminals:
+                deadlines[app_name] = None
+            elif not app["sessions"]:
+                since = self.inservice_apps.get(app_name)
+                deadlines[app_name] = None if since is None else since + policy.idle_time
+            else:
+                kernel_deadlines = []
+                for notebook in app["sessions"]:
+                    kernel_id = notebook["kernel"]["id"]
+                    if kernel_id not in self.kernel_snapshots:
+                        kernel_deadlines.append(now)  # deleted by this tick
+                    else:
+                        kernel_deadlines.append(self.kernel_deadlines.get(kernel_id))
+                deadlines[app_name] = (
+                    None if None in kernel_deadlines else max(kernel_deadlines)
+                )
+
+    # Function to accumulate the estimated dollars spent on idle apps and saved by
+    # deleting them since the last check. The apps are assumed to stay as seen
+    # by the last check in between. An idle app is one without a busy (or, when
+    # connections are counted, connected) kernel and without kept terminals. A
+    # deleted app saves its hourly price until it is started again, for at most
+    # savings_horizon seconds.
+    def account_costs(self, apps_info):
+        now = self.clock()
+        last, self._last_accounting = self._last_accounting, now
+        if last is None:
+            self.costs_since = now
+            last = now
+
+        burned = self.idle_hourly_cost * (now - last) / 3600
+        saved = 0.0
+        for app_name, (price, deleted_at) in list(self.reclaimed_apps.items()):
+            start = max(last, deleted_at)
+            end = min(now, deleted_at + self.savings_horizon)
+            if end > start:
+                saved += price * (end - start) / 3600
+            restarted = app_name in apps_info and deleted_at <= last
+            if restarted or end >= deleted_at + self.savings_horizon:
+                del self.reclaimed_apps[app_name]
+        self.idle_dollars_burned += burned
+        self.dollars_saved += saved
+        IDLE_DOLLARS_BURNED_TOTAL.inc(burned)
+        DOLLARS_SAVED_TOTAL.inc(saved)
+
+        # apps deleted by this check no longer cost anything
+        self.hourly_cost = 0.0
+        self.idle_hourly_cost = 0.0
+        for app_name in apps_info:
+            if app_name in self.reclaimed_apps:
+                continue
+            price = self.app_prices.get(app_name) or 0.0
+            self.hourly_cost += price
+            if self.shutdown_deadlines.get(app_name) is not None:
+                self.idle_hourly_cost += price
+
+    # Function to return the cost accounting of the checker and the hourly price
+    # of the apps seen by the last check, most expensive first
+    def get_costs(self):
+        apps = [
+            {
+                "app_name": app["app_name"],
+                "instance_type": app["instance_type"],
+                "hourly_price": self.app_prices.get(app["app_name"]),
+                "idle": self.shutdown_deadlines.get(app["app_name"]) is not None,
+            }
+            for app in (app_info["app"] for app_info in self.apps_info.values())
+            if app["app_name"] not in self.reclaimed_apps
+        ]
+        apps.sort(key=lambda app: app["hourly_price"] or 0.0, reverse=True)
+        return {
+            "since": self.costs_since,
+            "time": self._last_accounting,
+            "dollars_saved": round(self.dollars_saved, 4),
+            "idle_dollars_burned": round(self.idle_dollars_burned, 4),
+            "hourly_cost": round(self.hourly_cost, 4),
+            "idle_hourly_cost": round(self.idle_hourly_cost, 4),
+            "savings_horizon": self.savings_horizon,
+            "unpriced_instance_types": sorted(
+                {app["instance_type"] or "" for app in apps if app["hourly_price"] is None}
+            ),
+            "apps": apps,
+        }
+
+    # Function to build the deadlines of every app, kernel and terminal found by
+    # the last check, so that they can be served without listing them again.
+    # Kernels deleted by the check are due at the time of the check.
+    def build_forecast(self):
+        now = self.forecast_time
+        forecast = []
+        for app_name in sorted(self.apps_info):
+            app = self.apps_info[app_name]
+            policy = self.app_policies.get(app_name) or self.default_policy()
+            deadline = self.shutdown_deadlines.get(app_name)
+            kernels = []
+            for notebook in app["sessions"]:
+                kernel = notebook["kernel"]
+                if kernel["id"] in self.kernel_snapshots:
+                    kernel_deadline = self.kernel_deadlines.get(kernel["id"])
+                else:
+                    kernel_deadline = now  # deleted by this tick
+                kernels.append(
+                    {
+                        "id": kernel["id"],
+                        "name": kernel.get("name"),
+                        "execution_state": kernel["execution_state"],
+                        "deadline": kernel_deadline,
+                    }
+                )
+            # image terminals are shut down together with their app
+            terminals = [
+                {"name": terminal["name"], "deadline": deadline}
+                for terminal in app["terminals"]
+            ]
+            forecast.append(
+                {
+                    "app_name": app_name,
+                    "policy": policy.name,
+                    "instance_type": app["app"].get("instance_type"),
+                    "deadline": deadline,
+                    "kernels": kernels,
+                    "terminals": terminals,
+                }
+            )
+        return forecast
+
+    # Function to return a page of the forecast, with the seconds left before
+    # each deadline. The forecast is built by the first call after a check and
+    # cached until the next one. Only the apps of the page are copied.
+    def get_forecast(self, app_names=None, offset=0, limit=100):
+        now = self.clock()
+        if self.forecast is None:
+            self.forecast = self.build_forecast()
+
+        def remaining(deadline):
+            return None if deadline is None else max(0, int(deadline - now))
+
+        apps = self.forecast
+        if app_names:
+            apps = [app for app in apps if app["app_name"] in app_names]
+        page = []
+        for app in apps[offset : offset + limit]:
+            app = dict(app, seconds_remaining=remaining(app["deadline"]))
+            app["kernels"] = [
+                dict(kernel, seconds_remaining=remaining(kernel["deadline"]))
+                for kernel in app["kernels"]
+            ]
+            app["terminals"] = [
+                dict(terminal, seconds_remaining=remaining(terminal["deadline"]))
+                for terminal in app["terminals"]
+            ]
+            page.append(app)
+        return {
+            "time": self.forecast_time,
+            "total": len(apps),
+            "offset": offset,
+            "limit": limit,
+            "apps": page,
+        }
+
+    # Function to push the tick summary, the per-app countdowns and warnings for
+    # imminent shutdowns to the subscribers of the status stream
+    def publish_status(self):
+        now = self.clock()
+        self.events.publish(
+            "tick",
+            {
+                "count": self.count,
+                "time": now,
+                "summary": self.tick_summary,
+                "latency": self.tick_latency,
+            },
+        )
+        countdowns = {
+            app_name: None if deadline is None else max(0, int(deadline - now))
+            for app_name, deadline in self.shutdown_deadlines.items()
+        }
+        self.events.publish("countdown", {"time": now, "apps": countdowns})
+
+        warned = {}
+        warnings = {}
+        for app_name, deadline in self.shutdown_deadlines.items():
+            if deadline is not None and deadline - now <= self.warning_time:
+                warned[app_name] = deadline
+                if self._warned.get(app_name) != deadline:
+                    warnings[app_name] = countdowns[app_name]
+        self._warned = warned
+        if warnings:
+            self.events.publish("warning", {"time": now, "apps": warnings})
+
+    # Function to export the statistics of the last tick as Prometheus metrics
+    def record_tick_metrics(self):
+        for phase, seconds in self.tick_latency.items():
+            if phase != "fetch":
+                TICK_PHASE_DURATION_SECONDS.labels(phase).observe(seconds)
+        APPS_EXAMINED_TOTAL.inc(self.tick_summary["apps"])
+        KERNELS_EXAMINED_TOTAL.inc(self.tick_summary["sessions"])
+        # kernels have a deadline while they are idle, whatever their policy
+        oldest_activity = self.kernel_idle_since.peek()
+        OLDEST_IDLE_KERNEL_AGE_SECONDS.set(
+            0 if oldest_activity is None else self.clock() - oldest_activity
+        )
  
+    # Function to run a delete call while holding a slot of the delete semaphore.
+    # Returns whether the deletion succeeded instead of raising.
+    async def bounded_delete(self, semaphore, delete, target, kind, name):
+        async with semaphore:
+            try:
+                await delete(target)
+                return True
+            except Exception as e:
+                self.tick_summary["deletes_failed"] += 1
+                DELETIONS_TOTAL.labels(kind, "failure").inc()
+                ERRORS_TOTAL.labels(type(e).__name__).inc()
+                self.errors = "Failed to delete {} {}: {!r}".format(kind, name, e)
+                self.log.error(self.errors)
+                return False
+
+    # Function to delete the idle kernels of an app, then the app itself once
+    # all of its kernels were deleted successfully
+    async def delete_app_plan(self, semaphore, app_name, sessions, delete_app):
+        results = await asyncio.gather(
+            *[
+                self.bounded_delete(
+                    semaphore,
+                    self.delete_session,
+                    session,
+                    "kernel",
+                    session["kernel"]["id"],
+                )
+                for session in sessions
+            ]
+        )
+        if delete_app and all(results):
+            await self.bounded_delete(
+                semaphore, self.delete_application, app_name, "app", app_name
+            )
+
+    # Function to record the deletions planned by a tick in shadow mode, to the
+    # ring buffer of decisions and to the decision log. Recorded kernels and apps
+    # are not recorded again until their state changes.
+    def record_deletion_plan(self, plan):
+        now = self.clock()
+        decisions = []
+        for app_name, sessions, delete_app, reason in plan:
+            policy = self.app_policies[app_name]
+            for session in sessions:
+                kernel = session["kernel"]
+                decisions.append(
+                    {
+                        "time": now,
+                        "kind": "kernel",
+                        "name": kernel["id"],
+                        "app_name": app_name,
+                        "reason": "kernel idle for more than idle_time",
+                        "execution_state": kernel["execution_state"],
+                        "connections": kernel["connections"],
+                        "last_activity": str(kernel["last_activity"]),
+                        "policy": policy.name,
+                        "idle_time": policy.idle_time,
+                    }
+                )
+                self.kernel_deadlines.remove(kernel["id"])
+                self.kernel_idle_since.remove(kernel["id"])
+                self._shadowed_kernels[kernel["id"]] = self.kernel_snapshots.get(kernel["id"])
+                DELETIONS_TOTAL.labels("kernel", "shadow").inc()
+            if delete_app:
+                decisions.append(
+                    {
+                        "time": now,
+                        "kind": "app",
+                        "name": app_name,
+                        "app_name": app_name,
+                        "reason": reason,
+                        "idle_since": self.inservice_apps.get(app_name),
+                        "hourly_price": self.app_prices.get(app_name),
+                        "policy": policy.name,
+                        "idle_time": policy.idle_time,
+                    }
+                )
+                self._shadowed_apps[app_name] = self.inservice_apps.get(app_name)
+                DELETIONS_TOTAL.labels("app", "shadow").inc()
+        for decision in decisions:
+            self.log.info(
+                "Shadow mode, would delete %s %s: %s",
+                decision["kind"],
+                decision["name"],
+                decision["reason"],
+            )
+        self.decisions.extend(decisions)
+        self.tick_summary["decisions_recorded"] = len(decisions)
+        if not decisions or not self.decision_log:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.decision_log), exist_ok=True)
+            with open(self.decision_log, "a") as f:
+                for decision in decisions:
+                    f.write(json.dumps(decision, separators=(",", ":")) + "\n")
+        except OSError as e:
+            self.log.warning("Failed to write decision log %s: %r", self.decision_log, e)
+
+    # Function to return the last decisions recorded in shadow mode, newest last
+    def get_decisions(self, limit=None):
+        decisions = list(self.decisions)
+        return decisions if limit is None else decisions[-limit:]
+
+    # Function to run the deletions planned by a tick, with at most
+    # delete_concurrency requests in flight
+    async def run_deletion_plan(self, plan):
+        delete_start = time.monotonic()
+        if plan and self.shadow_mode:
+            self.record_deletion_plan(plan)
+        elif plan:
+            # the semaphore is acquired in order: reclaim the most expensive apps first
+            plan = sorted(
+                plan, key=lambda entry: self.app_prices.get(entry[0]) or 0.0, reverse=True
+            )
+            semaphore = asyncio.Semaphore(self.delete_concurrency)
+            await asyncio.gather(
+                *[
+                    self.delete_app_plan(semaphore, app_name, sessions, delete_app)
+                    for app_name, sessions, delete_app, _ in plan
+                ]
+            )
+        self.tick_latency["delete"] = time.monotonic() - delete_start
+
     # Run idle checks apps and image terminals
     async def idle_checks(self):
+        self.tick_latency = {}
+        self.tick_summary = {
+            "apps": 0,
+            "sessions": 0,
+            "terminals": 0,
+            "kernels_deleted": 0,
+            "apps_deleted": 0,
+            "deletes_failed": 0,
+            "kernels_new": 0,
+            "kernels_removed": 0,
+            "kernels_changed": 0,
+            "kernels_evaluated": 0,
+            "decisions_recorded": 0,
+            "malformed_terminals": 0,
+        }
+        tick_start = time.monotonic()
         apps_info = await self.build_app_info()
+        if apps_info is None:
+            self.log.warning("Skipping idle checks: incomplete view of apps, sessions and terminals")
+            self.next_deadline = None
+            self._check_soon = True
+            self.tick_latency["total"] = time.monotonic() - tick_start
+            return
+        self.tick_summary["apps"] = len(apps_info)
+        for app in apps_info.values():
+            self.tick_summary["sessions"] += len(app["sessions"])
+            self.tick_summary["terminals"] += len(app["terminals"])
+        decide_start = time.monotonic()
+        plan = self.decide(apps_info)
+        self.tick_latency["decide"] = time.monotonic() - decide_start
+        self.app_prices = {
+            app_name: self.prices.get(app["app"].get("instance_type"))
+            for app_name, app in apps_info.items()
+        }
+
+        await self.run_deletion_plan(plan)
+        self.save_inservice_apps()
+        self.sync_app_deadlines()
+        self.next_deadline = self.earliest_deadline()
+        self._check_soon = False
+        # apps with deletions planned by this check changed as well
+        self._changed_apps.update(app_name for app_name, _, _, _ in plan)
+        self.update_shutdown_deadlines(apps_info)
+        self.apps_info = apps_info
+        self.forecast = None  # built on demand by get_forecast
+        self.forecast_time = self.clock()
+        self.account_costs(apps_info)
+        self.tick_latency["total"] = time.monotonic() - tick_start
+        self.record_tick_metrics()
+        self.log_tick_summary()
+        if len(self.events) > 0:
+            self.publish_status()
+
+    # Function to decide which kernels and apps to delete given the apps info of
+    # a tick. It does no I/O and reads the time from self.clock only, so that
+    # recorded ticks can be replayed against a virtual clock.
+    def decide(self, apps_info):
+        now = self.clock()
+        self.diff_kernels(apps_info)
+        due_kernels = self.kernel_deadlines.due(now)
+        # deletions of the tick as (app_name, sessions to delete, delete the app,
+        # reason for deleting the app)
+        plan = []
         inservice_apps = self.inservice_apps
+        # this also prunes the stale entries reloaded from the state file
         deleted_apps = list(set(inservice_apps.keys()).difference(set(apps_info.keys())))
         for deleted_app in deleted_apps:
             inservice_apps.pop(deleted_app, None)
-            self.log.info("inservice app not inservice anymore : " + str(deleted_app))
+            self.log.debug("inservice app not inservice anymore : %s", deleted_app)
+        for deleted_app in self._shadowed_apps.keys() - apps_info.keys():
+            del self._shadowed_apps[deleted_app]
+        for deleted_app in self._app_states.keys() - apps_info.keys():
+            del self._app_states[deleted_app]
  
+        self.app_policies = {}
+        self._changed_apps = set()
         for app_name, app in apps_info.items():
+            kernels_evaluated = self.tick_summary["kernels_evaluated"]
+            policy = self.policy_for(app["app"])
+            self.app_policies[app_name] = policy
             num_sessions = len(app["sessions"])
             num_terminals = len(app["terminals"])
  
             if num_sessions > 0 or num_terminals > 0:
-                self.log.info(
-                    "# of sessions: "
-                    + str(num_sessions)
-                    + "; # of terminals: "
-                    + str(num_terminals)
+                self.log.debug(
+                    "%s: # of sessions: %d; # of terminals: %d",
+                    app_name,
+                    num_sessions,
+                    num_terminals,
                 )
  
             if num_sessions == 0 and num_terminals == 0:
@@ -239,52 +1307,88 @@ class IdleChecker(object):
                 # Check if the current app is part of the in service apps
                 if app_name not in inservice_apps:
                     # Regsiter a new inservice app
-                    inservice_apps[app_name] = time.time()
+                    inservice_apps[app_name] = self.clock()
  
                 else:
-                    if int(time.time() - inservice_apps[app_name]) > self.idle_time:
+                    if int(self.clock() - inservice_apps[app_name]) > policy.idle_time:
                         self.log.info(
-                            "Keep alive time for terminal reached : " + str(app_name)
+                            "Keep alive time for terminal reached : %s", app_name
                         )
-                        await self.delete_application(app_name)
+                        if app_name not in self._shadowed_apps:
+                            plan.append(
+                                (app_name, [], True, "no kernel sessions or terminals")
+                            )
  
-            # elif num_sessions < 1 and num_terminals > 0 and self.keep_terminals == True:
-            elif num_sessions < 1 and num_terminals > 0 and self.keep_terminals:
-                self.log.info("keep terminals flag is True. Not killing the terminals.")
-                pass
+            # elif num_sessions < 1 and num_terminals > 0 and policy.keep_terminals == True:
+            elif num_sessions < 1 and num_terminals > 0 and policy.keep_terminals:
+                self.log.debug("keep terminals flag is True. Not killing the terminals.")
+                self.unregister_inservice_app(app_name)
  
             elif (
-                # num_sessions < 1 and num_terminals > 0 and self.keep_terminals == False
+                # num_sessions < 1 and num_terminals > 0 and policy.keep_terminals == False
                 num_sessions < 1
                 and num_terminals > 0
-                and not self.keep_terminals
+                and not policy.keep_terminals
             ):
-                self.log.info("keep terminals flag: " + str(self.keep_terminals))
+                self.log.debug("keep terminals flag: %s", policy.keep_terminals)
                 # Wait for the inservice app
-                self.log.info("New inservice app found : " + str(app_name))
+                self.log.debug("New inservice app found : %s", app_name)
  
                 # Check if the current app is part of the in service apps
                 if app_name not in inservice_apps:
                     # Regsiter a new inservice app
-                    inservice_apps[app_name] = time.time()
+                    inservice_apps[app_name] = self.clock()
  
                 else:
-                    if int(time.time() - inservice_apps[app_name]) > self.idle_time:
+                    if int(self.clock() - inservice_apps[app_name]) > policy.idle_time:
                         self.log.info(
-                            "Keepalive time for terminal reached : " + str(app_name)
+                            "Keepalive time for terminal reached : %s", app_name
                         )
-                        await self.delete_application(app_name)
+                        if app_name not in self._shadowed_apps:
+                            plan.append(
+                                (app_name, [], True, "only image terminals left")
+                            )
  
             elif num_sessions > 0:
+                # the app is in use again, it is idle from its last kernel on
+                self.unregister_inservice_app(app_name)
                 # let's check if we have idle notebooks to kill
                 nb_deleted = 0
+                idle_sessions = []
                 for notebook in app["sessions"]:
-                    if self.check_notebook(notebook):
+                    # kernels recorded in shadow mode would have been deleted
+                    if self.is_shadowed_kernel(notebook):
+                        nb_deleted += 1
+                        continue
+                    if notebook["kernel"]["id"] in self._shadowed_kernels:
+                        # the kernel changed since it was recorded, so would its app
+                        del self._shadowed_kernels[notebook["kernel"]["id"]]
+                        self._shadowed_apps.pop(app_name, None)
+                    if self.check_notebook_changed(notebook, due_kernels, policy):
                         # handle kernel sessions which are stuck in "starting" state
                         if notebook["kernel"]["execution_state"] == "starting":
                             nb_deleted += 1
                         else:
-                            await self.delete_session(notebook)
+                            idle_sessions.append(notebook)
                             nb_deleted += 1
-                if num_sessions == nb_deleted and (not self.keep_terminals or num_terminals == 0):
-                    await self.delete_application(app_name)
\ No newline at end of file
+                delete_app = (
+                    num_sessions == nb_deleted
+                    and (not policy.keep_terminals or num_terminals == 0)
+                    and app_name not in self._shadowed_apps
+                )
+                if idle_sessions or delete_app:
+                    plan.append(
+                        (app_name, idle_sessions, delete_app, "all kernel sessions idle")
+                    )
+
+            # the shutdown deadline of the app is only recomputed if it changed:
+            # kernels were added, removed or re-evaluated, or its policy, terminals
+            # or in service entry changed
+            state = (policy, num_sessions, num_terminals, inservice_apps.get(app_name))
+            if (
+                self.tick_summary["kernels_evaluated"] != kernels_evaluated
+                or self._app_states.get(app_name) != state
+            ):
+                self._app_states[app_name] = state
+                self._changed_apps.add(app_name)
+        return plan
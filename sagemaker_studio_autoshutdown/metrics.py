@@ -0,0 +1,82 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Prometheus metrics exported by the idle checker.
+
+The metrics live in their own registry so that they are served by the
+extension's metrics handler only, next to (not inside) the server's /metrics.
+"""
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+REGISTRY = CollectorRegistry(auto_describe=True)
+
+TICK_PHASE_DURATION_SECONDS = Histogram(
+    "sagemaker_autoshutdown_tick_phase_duration_seconds",
+    "duration in seconds of each phase of an idle check",
+    ["phase"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    registry=REGISTRY,
+)
+
+KERNELS_EXAMINED_TOTAL = Counter(
+    "sagemaker_autoshutdown_kernels_examined_total",
+    "number of kernel sessions examined by idle checks",
+    registry=REGISTRY,
+)
+
+APPS_EXAMINED_TOTAL = Counter(
+    "sagemaker_autoshutdown_apps_examined_total",
+    "number of apps examined by idle checks",
+    registry=REGISTRY,
+)
+
+DELETIONS_TOTAL = Counter(
+    "sagemaker_autoshutdown_deletions_total",
+    "number of kernel and app deletions labeled by kind and result",
+    ["kind", "result"],
+    registry=REGISTRY,
+)
+
+ERRORS_TOTAL = Counter(
+    "sagemaker_autoshutdown_errors_total",
+    "number of errors raised during idle checks labeled by exception type",
+    ["type"],
+    registry=REGISTRY,
+)
+
+OLDEST_IDLE_KERNEL_AGE_SECONDS = Gauge(
+    "sagemaker_autoshutdown_oldest_idle_kernel_age_seconds",
+    "seconds since the last activity of the longest idle kernel at the last check",
+    registry=REGISTRY,
+)
+
+DOLLARS_SAVED_TOTAL = Counter(
+    "sagemaker_autoshutdown_dollars_saved_total",
+    "estimated dollars saved by the apps shut down by the idle checker",
+    registry=REGISTRY,
+)
+
+IDLE_DOLLARS_BURNED_TOTAL = Counter(
+    "sagemaker_autoshutdown_idle_dollars_burned_total",
+    "estimated dollars spent on apps while all of their kernels were idle",
+    registry=REGISTRY,
+)
+
+LOOP_RESTARTS_TOTAL = Counter(
+    "sagemaker_autoshutdown_loop_restarts_total",
+    "number of restarts of the idle check loop by the watchdog labeled by reason",
+    ["reason"],
+    registry=REGISTRY,
+)
@@ -0,0 +1,117 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import re
+from collections import namedtuple
+
+# Idle settings applied to an app. Policies of the table leave the settings
+# they do not override to None, to be filled with the global settings.
+Policy = namedtuple("Policy", ["name", "idle_time", "ignore_connections", "keep_terminals"])
+
+MATCH_FIELDS = ("app_name", "environment_arn", "instance_type")
+SETTING_FIELDS = ("idle_time", "ignore_connections", "keep_terminals")
+
+
+# Function to translate a glob pattern ('*' and '?' wildcards) into a regular
+# expression matching one field of a lookup key
+def _translate(pattern):
+    parts = []
+    for char in pattern:
+        if char == "*":
+            parts.append("[^\\x00]*")
+        elif char == "?":
+            parts.append("[^\\x00]")
+        else:
+            parts.append(re.escape(char))
+    return "".join(parts)
+
+
+class PolicyTable(object):
+    """Ordered table of idle policies matched against the apps of each check.
+
+    Each rule matches glob patterns ('*' and '?') on the app name, the
+    environment (image) ARN and the instance type of an app; missing patterns
+    match everything. The first matching rule wins. The rules are compiled
+    into a single regular expression with one alternative per rule, tried in
+    order, and the winning rule of each app is cached until the table is
+    replaced.
+
+    Rules are given as dicts, e.g.
+    {"instance_type": "ml.p3.*", "idle_time": 20, "keep_terminals": false},
+    with idle_time in minutes as in the settings endpoint.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = []
+        self.policies = []
+        alternatives = []
+        for index, rule in enumerate(rules):
+            if not isinstance(rule, dict):
+                raise ValueError("Policy {} is not an object".format(index))
+            self.rules.append(dict(rule))
+            unknown = set(rule) - set(MATCH_FIELDS) - set(SETTING_FIELDS) - {"name"}
+            if unknown:
+                raise ValueError(
+                    "Unknown policy fields: {}".format(", ".join(sorted(unknown)))
+                )
+            for field in MATCH_FIELDS:
+                if not isinstance(rule.get(field, ""), str):
+                    raise ValueError("Policy {} must be a string".format(field))
+            idle_time = rule.get("idle_time")
+            if idle_time is not None:
+                if isinstance(idle_time, bool) or not isinstance(idle_time, int):
+                    raise ValueError("Policy idle_time must be a number of minutes")
+                if idle_time <= 0:
+                    raise ValueError("Policy idle_time must be positive")
+                idle_time *= 60  # convert to seconds
+            for field in ("ignore_connections", "keep_terminals"):
+                if not isinstance(rule.get(field, False), bool):
+                    raise ValueError("Policy {} must be a boolean".format(field))
+            self.policies.append(
+                Policy(
+                    str(rule.get("name", "policy-{}".format(index))),
+                    idle_time,
+                    rule.get("ignore_connections"),
+                    rule.get("keep_terminals"),
+                )
+            )
+            alternatives.append(
+                "(?P<p{}>{})".format(
+                    index,
+                    "\\x00".join(_translate(rule.get(field, "*")) for field in MATCH_FIELDS),
+                )
+            )
+        self._regex = None
+        if alternatives:
+            self._regex = re.compile("(?:{})\\Z".format("|".join(alternatives)))
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.policies)
+
+    # Function to return the policy of an app, or None when no rule matches
+    def lookup(self, app_name, environment_arn, instance_type):
+        key = "\x00".join((app_name or "", environment_arn or "", instance_type or ""))
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        policy = None
+        if self._regex is not None:
+            match = self._regex.match(key)
+            if match is not None:
+                policy = self.policies[int(match.lastgroup[1:])]
+        if len(self._cache) >= 4096:
+            self._cache.clear()
+        self._cache[key] = policy
+        return policy
@@ -0,0 +1,86 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Hourly prices of the SageMaker Studio instance types, in US dollars.
+
+The defaults are approximate on-demand prices of Studio notebook instances in
+us-east-1. They can be overridden for other regions or negotiated rates with
+a JSON object of instance type to price in the prices file, or with the
+"prices" setting.
+"""
+
+import math
+
+DEFAULT_PRICES = {
+    "ml.t3.medium": 0.05,
+    "ml.t3.large": 0.1,
+    "ml.t3.xlarge": 0.2,
+    "ml.t3.2xlarge": 0.399,
+    "ml.m5.large": 0.115,
+    "ml.m5.xlarge": 0.23,
+    "ml.m5.2xlarge": 0.461,
+    "ml.m5.4xlarge": 0.922,
+    "ml.m5.8xlarge": 1.843,
+    "ml.m5.12xlarge": 2.765,
+    "ml.m5.16xlarge": 3.686,
+    "ml.m5.24xlarge": 5.53,
+    "ml.c5.large": 0.102,
+    "ml.c5.xlarge": 0.204,
+    "ml.c5.2xlarge": 0.408,
+    "ml.c5.4xlarge": 0.816,
+    "ml.c5.9xlarge": 1.836,
+    "ml.c5.12xlarge": 2.448,
+    "ml.c5.18xlarge": 3.672,
+    "ml.c5.24xlarge": 4.896,
+    "ml.r5.large": 0.151,
+    "ml.r5.xlarge": 0.302,
+    "ml.r5.2xlarge": 0.605,
+    "ml.r5.4xlarge": 1.21,
+    "ml.r5.8xlarge": 2.419,
+    "ml.r5.12xlarge": 3.629,
+    "ml.r5.16xlarge": 4.838,
+    "ml.r5.24xlarge": 7.258,
+    "ml.g4dn.xlarge": 0.736,
+    "ml.g4dn.2xlarge": 1.053,
+    "ml.g4dn.4xlarge": 1.686,
+    "ml.g4dn.8xlarge": 3.046,
+    "ml.g4dn.12xlarge": 5.477,
+    "ml.g4dn.16xlarge": 6.093,
+    "ml.g5.xlarge": 1.408,
+    "ml.g5.2xlarge": 1.515,
+    "ml.g5.4xlarge": 2.03,
+    "ml.g5.8xlarge": 3.06,
+    "ml.g5.12xlarge": 7.09,
+    "ml.g5.16xlarge": 5.12,
+    "ml.g5.24xlarge": 10.18,
+    "ml.g5.48xlarge": 20.36,
+    "ml.p3.2xlarge": 3.825,
+    "ml.p3.8xlarge": 14.688,
+    "ml.p3.16xlarge": 28.152,
+}
+
+
+# Function to validate a table of instance type to hourly price, raises ValueError
+def validate_prices(prices):
+    if not isinstance(prices, dict):
+        raise ValueError("Prices must be an object of instance type to hourly price")
+    for instance_type, price in prices.items():
+        if (
+            isinstance(price, bool)
+            or not isinstance(price, (int, float))
+            or not math.isfinite(price)
+            or price < 0
+        ):
+            raise ValueError("Invalid hourly price for {}: {!r}".format(instance_type, price))
+    return {str(instance_type): float(price) for instance_type, price in prices.items()}
@@ -0,0 +1,184 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""Replay recorded snapshots through the idle checker decision logic.
+
+Snapshots are recorded on a JupyterServer app by posting
+{"record_snapshots": true} to the sagemaker-studio-autoshutdown/settings
+endpoint. They can then be replayed offline against other settings, many
+times faster than real time:
+
+    python -m sagemaker_studio_autoshutdown.replay snapshots.jsonl.gz --idle-time 60 120
+
+The checker runs in shadow mode against a virtual clock: it ticks at every
+recorded snapshot and at the wake-ups it schedules in between, and records
+the kernels and apps it would delete instead of deleting them.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+
+from .idle_checker import IdleChecker
+from .snapshots import read_snapshots
+
+
+class VirtualClock(object):
+    """Clock of a replay, advanced by the replay loop instead of by real time."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class ReplayChecker(IdleChecker):
+    """Idle checker listing apps, sessions and terminals from a recorded snapshot."""
+
+    def __init__(self, clock=None):
+        super().__init__(state_file=None, decision_log=None)
+        self.clock = clock or VirtualClock()
+        self.shadow_mode = True
+        self.decisions = deque()  # keep every decision of the replay
+        self.snapshot = ([], [], [])
+        self.log = logging.getLogger(__name__)
+
+    async def get_apps(self):
+        return self.snapshot[0]
+
+    async def get_sessions(self):
+        return self.snapshot[1]
+
+    async def get_terminals(self):
+        return self.snapshot[2]
+
+
+# Function to replay snapshots through a ReplayChecker. Returns the statistics
+# of the replay; the decisions are left in checker.decisions.
+async def replay(snapshots, checker):
+    clock = checker.clock
+    decide_seconds = []
+    start_time = None
+    next_check = None
+
+    async def tick(now):
+        clock.now = now
+        checker.count += 1
+        await checker.idle_checks()
+        decide_seconds.append(checker.tick_latency.get("decide", 0.0))
+        return now + checker.next_interval()
+
+    wall_start = time.monotonic()
+    for snapshot_time, apps, sessions, terminals in snapshots:
+        if start_time is None:
+            start_time = snapshot_time
+        # checks scheduled by the checker before the next recorded snapshot
+        while next_check is not None and next_check < snapshot_time:
+            next_check = await tick(next_check)
+        checker.snapshot = (apps, sessions, terminals)
+        next_check = await tick(snapshot_time)
+    wall_seconds = time.monotonic() - wall_start
+
+    virtual_seconds = clock.now - start_time if start_time is not None else 0.0
+    decide_seconds.sort()
+    ticks = len(decide_seconds)
+    return {
+        "ticks": ticks,
+        "kernels": sum(1 for d in checker.decisions if d["kind"] == "kernel"),
+        "apps": sum(1 for d in checker.decisions if d["kind"] == "app"),
+        "virtual_seconds": virtual_seconds,
+        "wall_seconds": wall_seconds,
+        "speedup": virtual_seconds / wall_seconds if wall_seconds else None,
+        "ticks_per_second": ticks / wall_seconds if wall_seconds else None,
+        "decide_p50": decide_seconds[ticks // 2] if ticks else None,
+        "decide_p95": decide_seconds[min(ticks - 1, int(ticks * 0.95))] if ticks else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded idle checker snapshots against other settings."
+    )
+    parser.add_argument("snapshots", help="snapshot file recorded by the idle checker")
+    parser.add_argument(
+        "--idle-time",
+        type=int,
+        nargs="+",
+        default=[120],
+        help="idle time limits to replay, in minutes (default: 120)",
+    )
+    parser.add_argument("--keep-terminals", action="store_true")
+    parser.add_argument(
+        "--count-connections",
+        action="store_true",
+        help="do not shut down kernels with open connections",
+    )
+    parser.add_argument(
+        "--policies", help="JSON file holding the policy table to replay, as posted to settings"
+    )
+    parser.add_argument("--interval", type=int, default=10)
+    parser.add_argument("--max-interval", type=int, default=60)
+    parser.add_argument(
+        "--decisions", help="write the decisions of each replay to this JSON Lines file"
+    )
+    args = parser.parse_args()
+
+    policies = []
+    if args.policies:
+        with open(args.policies) as f:
+            policies = json.load(f)
+
+    snapshots = list(read_snapshots(args.snapshots))
+    print("{} snapshots loaded from {}".format(len(snapshots), args.snapshots))
+
+    decisions = open(args.decisions, "w") if args.decisions else None
+    try:
+        for idle_time in args.idle_time:
+            checker = ReplayChecker()
+            checker.idle_time = idle_time * 60
+            checker.keep_terminals = args.keep_terminals
+            checker.ignore_connections = not args.count_connections
+            checker.interval = args.interval
+            checker.max_interval = args.max_interval
+            checker.set_policies(policies)
+            stats = asyncio.run(replay(snapshots, checker))
+            print(
+                "idle_time={}min: {} kernels and {} apps deleted; {} ticks over {:.0f}s "
+                "replayed in {:.2f}s ({:.0f}x, decide p50 {:.2f}ms p95 {:.2f}ms)".format(
+                    idle_time,
+                    stats["kernels"],
+                    stats["apps"],
+                    stats["ticks"],
+                    stats["virtual_seconds"],
+                    stats["wall_seconds"],
+                    stats["speedup"] or 0,
+                    (stats["decide_p50"] or 0) * 1000,
+                    (stats["decide_p95"] or 0) * 1000,
+                )
+            )
+            if decisions is not None:
+                for decision in checker.decisions:
+                    decisions.write(
+                        json.dumps(dict(decision, replay_idle_time=idle_time)) + "\n"
+                    )
+    finally:
+        if decisions is not None:
+            decisions.close()
+
+
+if __name__ == "__main__":
+    main()
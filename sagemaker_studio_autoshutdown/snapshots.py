@@ -0,0 +1,92 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import gzip
+import json
+import logging
+import zlib
+from datetime import datetime
+
+SOURCES = ("apps", "sessions", "terminals")
+
+
+# Function to serialize the datetimes of in-process session listings
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+
+class SnapshotRecorder(object):
+    """Recording of the apps, sessions and terminals listed by each check.
+
+    Snapshots are appended to a gzipped JSON Lines file. A line only holds the
+    listings that changed since the previous line, so a day of checks on a
+    quiet server takes little space. The file is flushed after every line and
+    can be read with read_snapshots while it is being recorded.
+    """
+
+    def __init__(self, path, log=None):
+        self.path = path
+        self.log = log or logging.getLogger(__name__)
+        self.count = 0
+        self._file = None
+        self._last = {}
+
+    def record(self, time, apps, sessions, terminals):
+        parts = ['"time":' + json.dumps(round(time, 3))]
+        for source, listing in zip(SOURCES, (apps, sessions, terminals)):
+            serialized = json.dumps(listing, separators=(",", ":"), default=_json_default)
+            if self._last.get(source) != serialized:
+                parts.append('"{}":{}'.format(source, serialized))
+                self._last[source] = serialized
+        try:
+            if self._file is None:
+                # a new gzip member starts with the complete listings
+                self._file = gzip.open(self.path, "ab")
+            self._file.write(("{" + ",".join(parts) + "}\n").encode())
+            self._file.flush()
+        except OSError as e:
+            self.log.warning("Failed to record snapshot to %s: %r", self.path, e)
+            self.close()
+            return
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+        self._file = None
+        self._last = {}
+
+
+# Function to read the snapshots of a recording as (time, apps, sessions, terminals)
+# tuples, carrying over the listings omitted because they did not change. A
+# recording cut short by a crash is read up to its last complete line.
+def read_snapshots(path):
+    listings = dict.fromkeys(SOURCES, [])
+    with gzip.open(path, "rb") as f:
+        while True:
+            try:
+                line = f.readline()
+            except (EOFError, OSError, zlib.error):
+                return
+            if not line.endswith(b"\n"):
+                return
+            snapshot = json.loads(line)
+            for source in SOURCES:
+                if source in snapshot:
+                    listings[source] = snapshot[source]
+            yield (snapshot["time"], listings["apps"], listings["sessions"], listings["terminals"])
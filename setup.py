@@ -782,7 +782,8 @@ setup_args = dict(
     cmdclass= cmdclass,
     packages=setuptools.find_packages(),
     install_requires=[
-        "boto3>=1.10.44"
+        "boto3>=1.10.44",
+        "prometheus_client",
     ],
     zip_safe=False,
     include_package_data=True,
@@ -799,7 +800,10 @@ setup_args = dict(
         "Programming Language :: Python :: 3.8",
         "Framework :: Jupyter",
     ],
-    extras_require={"dev": ["python-minifier", "black", "pytest", "jupyterlab~=1.2",]},
+    extras_require={
+        "dev": ["python-minifier", "black", "pytest", "jupyterlab~=1.2",],
+        "curl": ["pycurl"],
+    },
 )
 
 
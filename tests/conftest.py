@@ -0,0 +1,112 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+from datetime import datetime, timezone
+
+import pytest
+
+from sagemaker_studio_autoshutdown.replay import ReplayChecker, VirtualClock
+
+START_TIME = 1700000000.0
+ENVIRONMENT_ARN = "arn:aws:sagemaker:us-west-2:123456789012:image/datascience-1.0"
+
+
+class DeleteResponse(object):
+    code = 204
+
+
+class Studio(object):
+    """In-memory apps, kernel sessions and terminals of a Studio user."""
+
+    def __init__(self):
+        self.apps = {}
+        self.sessions = {}
+        self.terminals = []
+        self.deleted = []  # ("kernel", id) and ("app", name) in deletion order
+
+    def add_app(self, app_name, instance_type="ml.t3.medium"):
+        self.apps[app_name] = {
+            "app_name": app_name,
+            "environment_arn": ENVIRONMENT_ARN,
+            "instance_type": instance_type,
+        }
+
+    def add_kernel(self, app_name, kernel_id, last_activity, execution_state="idle"):
+        self.sessions[kernel_id] = {
+            "id": "session-" + kernel_id,
+            "kernel": {
+                "id": kernel_id,
+                "name": "python3",
+                "app_name": app_name,
+                "execution_state": execution_state,
+                "connections": 0,
+                "last_activity": datetime.fromtimestamp(last_activity, timezone.utc).strftime(
+                    "%Y-%m-%dT%H:%M:%S.%fZ"
+                ),
+            },
+        }
+
+    def add_terminal(self, name):
+        self.terminals.append({"name": name})
+
+    def delete(self, url):
+        kind, name = url.rstrip("/").split("/")[-2:]
+        if kind == "kernels":
+            self.sessions.pop(name)
+            self.deleted.append(("kernel", name))
+        else:
+            self.apps.pop(name)
+            self.deleted.append(("app", name))
+        return DeleteResponse()
+
+
+class StudioChecker(ReplayChecker):
+    """Idle checker listing and deleting from a Studio, against a virtual clock."""
+
+    def __init__(self, studio):
+        super().__init__(clock=VirtualClock(START_TIME))
+        self.price_file = None
+        self.studio = studio
+        self.base_url = "/"
+        self.shadow_mode = False
+
+    async def get_apps(self):
+        return list(self.studio.apps.values())
+
+    async def get_sessions(self):
+        return list(self.studio.sessions.values())
+
+    async def get_terminals(self):
+        return list(self.studio.terminals)
+
+    async def delete_with_xsrf(self, url):
+        return self.studio.delete(url)
+
+    # Function to run the checks scheduled by the checker until the given time
+    async def run_until(self, end_time):
+        while self.clock.now <= end_time:
+            self.count += 1
+            await self.idle_checks()
+            self.clock.now += self.next_interval()
+
+
+@pytest.fixture
+def studio():
+    return Studio()
+
+
+@pytest.fixture
+def checker(studio, tmp_path):
+    checker = StudioChecker(studio)
+    checker.snapshot_file = str(tmp_path / "snapshots.jsonl.gz")
+    return checker
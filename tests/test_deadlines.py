@@ -0,0 +1,67 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+
+from sagemaker_studio_autoshutdown.deadlines import DeadlineQueue
+
+
+def test_due_returns_keys_at_or_before_now():
+    queue = DeadlineQueue()
+    queue.update("a", 10)
+    queue.update("b", 20)
+    queue.update("c", 30)
+    assert queue.due(5) == set()
+    assert queue.due(20) == {"a", "b"}
+    assert queue.due(100) == {"a", "b", "c"}
+    # due() does not remove the keys
+    assert len(queue) == 3
+
+
+def test_due_skips_stale_and_duplicate_entries():
+    queue = DeadlineQueue()
+    queue.update("a", 10)
+    queue.update("a", 50)  # stale (10, "a") left in the heap
+    queue.update("b", 10)
+    queue.update("b", 10)  # same deadline, not pushed twice
+    queue.update("c", 15)
+    queue.remove("c")
+    assert queue.due(20) == {"b"}
+    assert queue.due(50) == {"a", "b"}
+    assert queue.get("a") == 50
+    assert len(queue._heap) == 4
+
+
+def test_peek_after_remove():
+    queue = DeadlineQueue()
+    assert queue.peek() is None
+    queue.update("a", 10)
+    queue.update("b", 20)
+    queue.remove("a")
+    assert queue.peek() == 20
+    queue.update("b", 30)
+    assert queue.peek() == 30
+    queue.remove("b")
+    assert queue.peek() is None
+    assert "b" not in queue
+
+
+def test_compaction_bounds_heap():
+    queue = DeadlineQueue()
+    for deadline in range(1000):
+        queue.update("a", deadline)
+        queue.update("b", deadline + 1)
+    assert len(queue) == 2
+    assert len(queue._heap) <= 2 * len(queue) + 64 + 1
+    assert queue.peek() == 999
+    assert queue.due(999) == {"a"}
+    assert queue.due(1000) == {"a", "b"}
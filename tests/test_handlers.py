@@ -0,0 +1,112 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+
+import json
+
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+
+from sagemaker_studio_autoshutdown import handlers
+from sagemaker_studio_autoshutdown.idle_checker import IdleChecker
+
+
+class HandlersTestCase(AsyncHTTPTestCase):
+    def setUp(self):
+        self.saved_idle_checker = handlers.idle_checker
+        handlers.idle_checker = self.idle_checker = IdleChecker(
+            state_file=None, decision_log=None, price_file=None
+        )
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        handlers.idle_checker = self.saved_idle_checker
+
+    def get_app(self):
+        app = tornado.web.Application(base_url="/")
+        handlers.setup_handlers(app, "sagemaker-studio-autoshutdown")
+        return app
+
+    def post_settings(self, settings):
+        return self.fetch(
+            "/sagemaker-studio-autoshutdown/settings",
+            method="POST",
+            body=json.dumps(settings),
+        )
+
+    def test_settings_applied(self):
+        response = self.post_settings({"idle_time": 5, "interval": 20, "log_level": "debug"})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.idle_checker.idle_time, 300)
+        self.assertEqual(self.idle_checker.interval, 20)
+        self.assertEqual(self.idle_checker.log_level, "DEBUG")
+
+    def test_invalid_settings_change_nothing(self):
+        for settings in (
+            {"idle_time": 5, "shadow_mode": True, "interval": 0},
+            {"idle_time": 5, "interval": "often"},
+            {"idle_time": 5, "max_interval": None},
+            {"idle_time": 5, "tick_timeout": "slow"},
+            {"idle_time": 5, "log_level": "chatty"},
+            {"idle_time": 5, "policies": "none"},
+            {"idle_time": 5, "prices": {"ml.t3.medium": -1}},
+            {"idle_time": "five"},
+            {"idle_time": -5},
+            {"idle_time": 0},
+            {"idle_time": True},
+            {"idle_time": 5, "keep_terminals": "no"},
+            {"idle_time": 5, "in_process": "false"},
+            {"idle_time": 5, "shadow_mode": "false"},
+            {"idle_time": 5, "record_snapshots": 1},
+        ):
+            response = self.post_settings(settings)
+            self.assertEqual(response.code, 400, settings)
+        self.assertEqual(self.idle_checker.idle_time, 7200)
+        self.assertFalse(self.idle_checker.keep_terminals)
+        self.assertFalse(self.idle_checker.in_process)
+        self.assertFalse(self.idle_checker.shadow_mode)
+        self.assertIsNone(self.idle_checker.recorder)
+        self.assertEqual(self.idle_checker.interval, 10)
+
+    def test_metrics_exposition_format(self):
+        last_activity = self._app.settings.get("api_last_activity")
+        response = self.fetch("/sagemaker-studio-autoshutdown/metrics")
+        self.assertEqual(response.code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+        self.assertIn(b"sagemaker_autoshutdown_errors_total", response.body)
+        self.assertEqual(self._app.settings.get("api_last_activity"), last_activity)
+
+    def assert_no_activity(self, path):
+        last_activity = self._app.settings.get("api_last_activity")
+        response = self.fetch(path)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self._app.settings.get("api_last_activity"), last_activity)
+        return response
+
+    def test_forecast_not_tracked_as_activity(self):
+        self.assert_no_activity("/sagemaker-studio-autoshutdown/forecast")
+
+    def test_decisions_not_tracked_as_activity(self):
+        response = self.assert_no_activity("/sagemaker-studio-autoshutdown/decisions")
+        self.assertEqual(json.loads(response.body)["decisions"], [])
+
+    def test_costs_not_tracked_as_activity(self):
+        response = self.assert_no_activity("/sagemaker-studio-autoshutdown/costs")
+        self.assertEqual(json.loads(response.body)["apps"], [])
+
+    def test_health_not_tracked_as_activity(self):
+        response = self.assert_no_activity("/sagemaker-studio-autoshutdown/health")
+        health = json.loads(response.body)
+        self.assertFalse(health["running"])
+        self.assertIsNone(health["last_error"])
@@ -0,0 +1,413 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+
+import asyncio
+import io
+import json
+import logging
+
+import pytest
+from tornado.httpclient import HTTPClientError, HTTPRequest, HTTPResponse
+from tornado.httputil import HTTPHeaders
+
+from sagemaker_studio_autoshutdown.idle_checker import IdleChecker, parse_terminal_name
+from sagemaker_studio_autoshutdown.metrics import REGISTRY
+
+from conftest import ENVIRONMENT_ARN, START_TIME, Studio, StudioChecker
+
+
+def test_parse_terminal_name():
+    assert parse_terminal_name("1") is None
+    assert parse_terminal_name(ENVIRONMENT_ARN + "__t1__ml.t3.medium") == (
+        ENVIRONMENT_ARN,
+        "t1",
+        "ml.t3.medium",
+    )
+    with pytest.raises(ValueError):
+        parse_terminal_name(ENVIRONMENT_ARN + "__t1")
+
+
+def test_malformed_terminals_counted_and_logged_once(studio, checker, caplog):
+    studio.add_app("app-1")
+    studio.add_terminal("1")
+    studio.add_terminal(ENVIRONMENT_ARN + "__broken")
+    studio.add_terminal(ENVIRONMENT_ARN + "__t1__ml.t3.medium")
+
+    with caplog.at_level(logging.WARNING):
+        asyncio.run(checker.idle_checks())
+        assert checker.tick_summary["malformed_terminals"] == 1
+        assert checker.tick_summary["terminals"] == 1
+        asyncio.run(checker.idle_checks())
+        assert checker.tick_summary["malformed_terminals"] == 1
+
+    warnings = [r for r in caplog.records if "Malformed terminal name" in r.getMessage()]
+    assert len(warnings) == 1
+
+
+class XsrfServer(object):
+    """Stand-in for IdleChecker.fetch issuing and checking xsrf tokens."""
+
+    def __init__(self):
+        self.token = "token-1"
+        self.tree_fetches = 0
+
+    async def fetch(self, url, method="GET", headers=None):
+        await asyncio.sleep(0.01)
+        if url.endswith("/tree"):
+            self.tree_fetches += 1
+            return HTTPResponse(
+                HTTPRequest(url),
+                200,
+                headers=HTTPHeaders({"Set-Cookie": "_xsrf=%s; Path=/" % self.token}),
+            )
+        if headers["X-Xsrftoken"] != self.token:
+            raise HTTPClientError(403)
+        return HTTPResponse(HTTPRequest(url, method=method), 204)
+
+
+def test_concurrent_deletes_share_xsrf_fetch():
+    checker = IdleChecker(state_file=None, decision_log=None, price_file=None)
+    checker.base_url = "/"
+    server = XsrfServer()
+    checker.fetch = server.fetch
+    urls = ["http://localhost/api/kernels/k%d" % i for i in range(10)]
+
+    async def delete_all():
+        return await asyncio.gather(*(checker.delete_with_xsrf(url) for url in urls))
+
+    async def run():
+        responses = await delete_all()
+        assert [response.code for response in responses] == [204] * 10
+        assert server.tree_fetches == 1
+
+        # all the deletes rejected with the old token wait for a single refresh
+        server.token = "token-2"
+        responses = await delete_all()
+        assert [response.code for response in responses] == [204] * 10
+        assert server.tree_fetches == 2
+
+    asyncio.run(run())
+
+
+class SlowFirstClient(object):
+    """Stand-in for the pooled HTTP client whose first request times out."""
+
+    def __init__(self):
+        self.request_timeouts = []
+
+    async def fetch(self, url, request_timeout=None, **kwargs):
+        self.request_timeouts.append(request_timeout)
+        if len(self.request_timeouts) == 1:
+            await asyncio.sleep(request_timeout)
+            raise HTTPClientError(599, "Timeout")
+        return HTTPResponse(HTTPRequest(url), 200, buffer=io.BytesIO(b"[]"))
+
+
+def test_listing_retried_within_fetch_timeout():
+    checker = IdleChecker(state_file=None, decision_log=None, price_file=None)
+    checker.base_url = "/"
+    checker.tornado_client = client = SlowFirstClient()
+    checker.list_request_timeout = 0.05
+    checker.fetch_timeout = 0.2
+    checker.retry_backoff = 0.01
+
+    sessions = asyncio.run(checker.timed_fetch("sessions", checker.get_sessions))
+    assert sessions == []
+    assert client.request_timeouts == [0.05, 0.05]
+
+
+def test_unchanged_kernels_skipped_until_due(studio, checker):
+    checker.idle_time = 600
+    studio.add_app("app-1")
+    studio.add_kernel("app-1", "k1", START_TIME)
+    studio.add_kernel("app-1", "k2", START_TIME, execution_state="busy")
+
+    asyncio.run(checker.idle_checks())
+    assert checker.tick_summary["kernels_evaluated"] == 2
+    assert checker.kernel_deadlines.get("k1") == START_TIME + 600
+
+    # unchanged and not due: not re-evaluated
+    checker.clock.now += 60
+    asyncio.run(checker.idle_checks())
+    assert checker.tick_summary["kernels_evaluated"] == 0
+    assert studio.deleted == []
+
+    # a changed kernel is re-evaluated
+    studio.sessions["k2"]["kernel"]["execution_state"] = "idle"
+    asyncio.run(checker.idle_checks())
+    assert checker.tick_summary["kernels_changed"] == 1
+    assert checker.tick_summary["kernels_evaluated"] == 1
+
+    # a due kernel is re-evaluated and deleted although it did not change
+    checker.clock.now = START_TIME + 601
+    asyncio.run(checker.idle_checks())
+    assert checker.tick_summary["kernels_changed"] == 0
+    assert ("kernel", "k1") in studio.deleted
+
+
+def build_fleet(studio):
+    studio.add_app("app-kernels")
+    studio.add_kernel("app-kernels", "k1", START_TIME)
+    studio.add_kernel("app-kernels", "k2", START_TIME + 50)
+    studio.add_app("app-busy")
+    studio.add_kernel("app-busy", "k3", START_TIME)
+    studio.add_kernel("app-busy", "k4", START_TIME, execution_state="busy")
+    studio.add_app("app-empty")
+
+
+@pytest.mark.parametrize("idle_time", [300, 600])
+def test_shadow_mode_records_what_would_be_deleted(idle_time):
+    real_studio = Studio()
+    build_fleet(real_studio)
+    real = StudioChecker(real_studio)
+    real.idle_time = idle_time
+    asyncio.run(real.run_until(START_TIME + 3 * idle_time))
+
+    shadow_studio = Studio()
+    build_fleet(shadow_studio)
+    shadow = StudioChecker(shadow_studio)
+    shadow.idle_time = idle_time
+    shadow.shadow_mode = True
+    asyncio.run(shadow.run_until(START_TIME + 3 * idle_time))
+
+    assert shadow_studio.deleted == []
+    assert sorted(real_studio.deleted) == [
+        ("app", "app-empty"),
+        ("app", "app-kernels"),
+        ("kernel", "k1"),
+        ("kernel", "k2"),
+        ("kernel", "k3"),
+    ]
+    # each deletion is recorded once, although the shadowed objects are still listed
+    recorded = [(decision["kind"], decision["name"]) for decision in shadow.decisions]
+    assert sorted(recorded) == sorted(real_studio.deleted)
+
+
+def test_keep_terminals_toggle_applies_to_policies(studio, checker):
+    checker.idle_time = 600
+    checker.keep_terminals = True
+    checker.set_policies([{"instance_type": "ml.t3.*", "idle_time": 10}])
+    studio.add_app("app-1")
+    studio.add_terminal(ENVIRONMENT_ARN + "__t1__ml.t3.medium")
+
+    asyncio.run(checker.run_until(START_TIME + 1200))
+    assert checker.app_policies["app-1"].keep_terminals is True
+    assert studio.deleted == []
+
+    checker.keep_terminals = False
+    checker.wake()
+    asyncio.run(checker.idle_checks())
+    assert checker.app_policies["app-1"].keep_terminals is False
+    assert checker.app_policies["app-1"].idle_time == 600
+    asyncio.run(checker.run_until(START_TIME + 2400))
+    assert studio.deleted == [("app", "app-1")]
+
+
+def test_checks_spaced_by_max_interval_without_deadlines(studio, checker):
+    # no apps at all
+    assert checker.next_interval() == checker.interval
+    asyncio.run(checker.idle_checks())
+    assert checker.next_interval() == checker.max_interval
+
+    # only a busy kernel, which has no deadline until its state changes
+    studio.add_app("app-1")
+    studio.add_kernel("app-1", "k1", START_TIME, execution_state="busy")
+    asyncio.run(checker.idle_checks())
+    assert checker.next_deadline is None
+    assert checker.next_interval() == checker.max_interval
+
+    # wake() asks for the next check right away
+    checker.wake()
+    assert checker.next_interval() == checker.interval
+    asyncio.run(checker.idle_checks())
+    assert checker.next_interval() == checker.max_interval
+
+    # so does a check skipped on a partial view of the server
+    async def fail():
+        raise HTTPClientError(503)
+
+    checker.get_terminals = fail
+    asyncio.run(checker.idle_checks())
+    assert checker.next_interval() == checker.interval
+
+
+def test_inservice_apps_saved_and_reloaded(tmp_path):
+    state_file = str(tmp_path / "state" / "inservice_apps.json")
+    checker = IdleChecker(state_file=state_file, decision_log=None, price_file=None)
+    assert checker.inservice_apps == {}
+    checker.inservice_apps = {"app-1": START_TIME + 0.5, "app-2": START_TIME + 60}
+    checker.save_inservice_apps()
+
+    reloaded = IdleChecker(state_file=state_file, decision_log=None, price_file=None)
+    assert reloaded.inservice_apps == {"app-1": START_TIME, "app-2": START_TIME + 60}
+
+
+@pytest.mark.parametrize("content", ["not json", "[1, 2]", '{"app-1": "yesterday"}'])
+def test_unreadable_state_file_ignored(tmp_path, content):
+    state_file = tmp_path / "inservice_apps.json"
+    state_file.write_text(content)
+    checker = IdleChecker(state_file=str(state_file), decision_log=None, price_file=None)
+    assert checker.inservice_apps == {}
+
+
+def test_stale_inservice_apps_pruned_at_first_check(studio, tmp_path):
+    state_file = tmp_path / "inservice_apps.json"
+    state_file.write_text(json.dumps({"app-1": START_TIME - 60, "gone": START_TIME - 60}))
+    studio.add_app("app-1")
+    checker = StudioChecker(studio)
+    checker.state_file = str(state_file)
+    checker.load_inservice_apps()
+    assert set(checker.inservice_apps) == {"app-1", "gone"}
+
+    asyncio.run(checker.idle_checks())
+    # the reloaded app keeps the time it was first seen idle
+    assert checker.inservice_apps == {"app-1": START_TIME - 60}
+    assert json.loads(state_file.read_text()) == {"app-1": START_TIME - 60}
+
+
+def test_app_in_use_again_loses_its_deadline(studio, checker):
+    checker.idle_time = 600
+    studio.add_app("app-1")
+    asyncio.run(checker.idle_checks())
+    assert checker.inservice_apps == {"app-1": START_TIME}
+    assert checker.app_deadlines.get("app-1") == START_TIME + 600
+
+    # a kernel is started in the app and stays busy for an hour
+    checker.clock.now += 60
+    studio.add_kernel("app-1", "k1", checker.clock.now, execution_state="busy")
+    asyncio.run(checker.idle_checks())
+    assert checker.inservice_apps == {}
+    assert "app-1" not in checker.app_deadlines
+    asyncio.run(checker.run_until(START_TIME + 3600))
+    assert checker.next_deadline is None
+    assert checker.next_interval() == checker.max_interval
+    assert studio.deleted == []
+
+    # once the kernel is gone, the app is idle from then on
+    del studio.sessions["k1"]
+    asyncio.run(checker.idle_checks())
+    assert checker.inservice_apps == {"app-1": checker.clock.now}
+
+
+class FullRecomputeChecker(StudioChecker):
+    """Checker recomputing the shutdown deadline of every app at each check."""
+
+    def decide(self, apps_info):
+        plan = super().decide(apps_info)
+        self._changed_apps = set(apps_info)
+        return plan
+
+
+def test_shutdown_deadlines_recomputed_for_changed_apps_only():
+    studios = [Studio(), Studio()]
+    checkers = [StudioChecker(studios[0]), FullRecomputeChecker(studios[1])]
+    for studio, checker in zip(studios, checkers):
+        build_fleet(studio)
+        studio.add_app("app-terminals")
+        studio.add_terminal(ENVIRONMENT_ARN + "__t1__ml.t3.medium")
+        checker.idle_time = 600
+
+    for step in range(40):
+        for studio, checker in zip(studios, checkers):
+            if step == 5:
+                studio.sessions["k4"]["kernel"]["execution_state"] = "idle"
+            if step == 10:
+                studio.add_kernel("app-busy", "k5", checker.clock.now)
+            if step == 20:
+                checker.keep_terminals = True
+            checker.count += 1
+            asyncio.run(checker.idle_checks())
+            checker.clock.now += 30
+        assert checkers[0].shutdown_deadlines == checkers[1].shutdown_deadlines, step
+    assert studios[0].deleted == studios[1].deleted
+    assert checkers[0].tick_summary["apps"] < 5
+
+
+def test_status_published_to_subscribers_only(studio, checker):
+    checker.idle_time = 200
+    studio.add_app("app-1")
+    asyncio.run(checker.idle_checks())
+    assert checker._warned == {}
+
+    async def subscribe_and_check():
+        queue = checker.events.subscribe()
+        await checker.idle_checks()
+        return [queue.get_nowait().split(b"\n")[0] for _ in range(queue.qsize())]
+
+    assert asyncio.run(subscribe_and_check()) == [
+        b"event: tick",
+        b"event: countdown",
+        b"event: warning",
+    ]
+
+
+def test_forecast_built_on_demand_and_cached(studio, checker):
+    checker.idle_time = 600
+    build_fleet(studio)
+    asyncio.run(checker.idle_checks())
+    assert checker.forecast is None
+
+    checker.clock.now += 100
+    forecast = checker.get_forecast()
+    assert forecast["time"] == START_TIME
+    assert [app["app_name"] for app in forecast["apps"]] == [
+        "app-busy",
+        "app-empty",
+        "app-kernels",
+    ]
+    app_kernels = forecast["apps"][2]
+    assert app_kernels["deadline"] == START_TIME + 650
+    assert app_kernels["seconds_remaining"] == 550
+    assert [kernel["deadline"] for kernel in app_kernels["kernels"]] == [
+        START_TIME + 600,
+        START_TIME + 650,
+    ]
+    assert forecast["apps"][0]["deadline"] is None
+
+    cached = checker.forecast
+    checker.get_forecast(app_names=["app-empty"])
+    assert checker.forecast is cached
+
+    # the next check drops the cached forecast
+    asyncio.run(checker.idle_checks())
+    assert checker.forecast is None
+    assert checker.get_forecast()["time"] == START_TIME + 100
+
+
+def oldest_idle_kernel_age():
+    return REGISTRY.get_sample_value("sagemaker_autoshutdown_oldest_idle_kernel_age_seconds")
+
+
+def test_oldest_idle_kernel_age(studio, checker):
+    checker.idle_time = 600
+    studio.add_app("app-1")
+    studio.add_kernel("app-1", "k1", START_TIME)
+    studio.add_kernel("app-1", "k2", START_TIME + 50)
+    studio.add_kernel("app-1", "k3", START_TIME - 500, execution_state="busy")
+
+    checker.clock.now = START_TIME + 100
+    asyncio.run(checker.idle_checks())
+    assert oldest_idle_kernel_age() == 100
+
+    # k1 is busy again: k2 is the oldest idle kernel
+    studio.add_kernel("app-1", "k1", START_TIME - 500, execution_state="busy")
+    asyncio.run(checker.idle_checks())
+    assert oldest_idle_kernel_age() == 50
+
+    # k2 is deleted once idle for idle_time
+    checker.clock.now = START_TIME + 700
+    asyncio.run(checker.idle_checks())
+    assert ("kernel", "k2") in studio.deleted
+    assert oldest_idle_kernel_age() == 0
+    assert len(checker.kernel_idle_since) == 0
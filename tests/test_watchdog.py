@@ -0,0 +1,163 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+
+import asyncio
+import logging
+
+import pytest
+
+from sagemaker_studio_autoshutdown.metrics import REGISTRY
+from sagemaker_studio_autoshutdown.replay import VirtualClock
+
+
+def restarts_total(reason):
+    return (
+        REGISTRY.get_sample_value(
+            "sagemaker_autoshutdown_loop_restarts_total", {"reason": reason}
+        )
+        or 0
+    )
+
+
+def errors_total(error):
+    return REGISTRY.get_sample_value("sagemaker_autoshutdown_errors_total", {"type": error}) or 0
+
+
+@pytest.fixture
+def watched(checker):
+    # the check loop sleeps until it is woken up or restarted
+    checker.interval = checker.max_interval = 3600
+    checker.monotonic = VirtualClock(1000.0)
+    checker._running = True
+    return checker
+
+
+async def crash():
+    raise RuntimeError("check loop crashed")
+
+
+async def kill(task):
+    task.cancel()
+    await asyncio.sleep(0.01)
+    assert task.done()
+
+
+def test_dead_loop_restarted_with_backoff(watched):
+    clock = watched.monotonic
+    dead_restarts = restarts_total("dead")
+
+    async def scenario():
+        watched.task = asyncio.ensure_future(crash())
+        await asyncio.sleep(0)
+        watched.check_loop()
+        assert watched.restarts == 1
+        assert not watched.task.done()
+
+        # restarts are spaced by 1, then 2 seconds
+        await kill(watched.task)
+        clock.now += 0.5
+        watched.check_loop()
+        assert watched.restarts == 1
+        clock.now += 0.5
+        watched.check_loop()
+        assert watched.restarts == 2
+
+        await kill(watched.task)
+        clock.now += 1.5
+        watched.check_loop()
+        assert watched.restarts == 2
+        clock.now += 0.5
+        watched.check_loop()
+        assert watched.restarts == 3
+        assert watched._restart_delay == 8
+
+        # a live loop is left alone
+        watched.check_loop()
+        assert watched.restarts == 3
+
+        # the next successful check resets the backoff
+        await asyncio.sleep(0)
+        watched.wake()
+        await asyncio.sleep(0.05)
+        assert watched.last_tick is not None
+        assert watched._restart_delay == 1
+        await watched.stop()
+
+    asyncio.run(scenario())
+    assert restarts_total("dead") == dead_restarts + 3
+    assert '"restarts": 3' in watched.health
+
+
+def test_stalled_loop_cancelled_and_restarted(watched):
+    clock = watched.monotonic
+    stalled_restarts = restarts_total("stalled")
+
+    async def scenario():
+        watched.task = stalled = asyncio.ensure_future(watched.run_idle_checks())
+        await asyncio.sleep(0)
+        clock.now += watched.stall_timeout()
+        watched.check_loop()
+        assert watched.task is stalled
+
+        clock.now += 1
+        watched.check_loop()
+        await asyncio.sleep(0.01)
+        assert stalled.cancelled()
+        assert watched.task is not stalled
+        assert watched.last_heartbeat == clock.now
+        await watched.stop()
+
+    asyncio.run(scenario())
+    assert watched.restarts == 1
+    assert restarts_total("stalled") == stalled_restarts + 1
+
+
+def test_timed_out_check_recorded(watched):
+    timeouts = errors_total("TimeoutError")
+    watched.interval = 0.01
+    watched.tick_timeout = 0.05
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    watched.idle_checks = hang
+
+    async def scenario():
+        watched.task = asyncio.ensure_future(watched.run_idle_checks())
+        await asyncio.sleep(0.1)
+        await watched.stop()
+
+    asyncio.run(scenario())
+    assert watched.last_error == "TimeoutError"
+    assert watched.last_tick is None
+    assert "TimeoutError" in watched.errors
+    assert errors_total("TimeoutError") >= timeouts + 1
+    # the next check is not delayed by the timed out one
+    assert watched.next_interval() == watched.interval
+
+
+def test_watchdog_restarts_dead_loop(checker):
+    checker.interval = checker.max_interval = 3600
+    checker.watchdog_interval = 0.01
+
+    async def scenario():
+        checker.start("/", logging.getLogger(__name__), 600, False)
+        await kill(checker.task)
+        await asyncio.sleep(0.1)
+        assert checker.restarts == 1
+        assert not checker.task.done()
+        await checker.stop()
+
+    asyncio.run(scenario())
+    assert checker.watchdog_task is None